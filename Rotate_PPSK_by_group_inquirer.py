@@ -1,21 +1,28 @@
 import argparse
+import os
 import logging
-import getpass
-import pandas as pd
 from collections import defaultdict
-import csv
-import inquirer
 from pprint import pprint
-from lib.xiq_api import XIQ, logger
+
+from lib.xiq_api import logger
+from lib.logger import CustomLogger
+from lib.rotation import exportGroup, rotateGroup
+from lib.batch import isBatchMode, runBatchFromArgs
+from lib.group_catalog import catalogFromArgs
+from lib.checkpoint import readCheckpoint, checkNoEarlierRun
+from lib.planner import planGroup, logPlan
+from lib.scheduler import runScheduleFromArgs
+from lib.cli import addCommonArguments, runOptionsFromArgs, clientFromArgs, finishRun
 
 ############################################
 ###### User Variables
 ############################################
 _XIQ_API_token = ''      # Enter XIQ auth bearer token
-_pageSize = 10  # number of records to pull for each page (max 100)
+if not _XIQ_API_token:
+    _XIQ_API_token = os.environ.get("XIQ_API_TOKEN", '')   # or provide it in the environment
+_pageSize = 100  # number of records to pull for each page (max 100)
 
 _script_name = "Rotate_PPSK_by_group"
-logger.setLevel(logging.INFO)
 
 
 
@@ -23,22 +30,21 @@ logger.setLevel(logging.INFO)
 
 
 parser = argparse.ArgumentParser()
-parser.add_argument('--external',action="store_true", help="Optional - adds External Account selection, to use an external VIQ")
-parser.add_argument('--csv_file', default='user_password_list.csv', help='name of csv file to create')
+addCommonArguments(parser)
 args = parser.parse_args()
+# logging (and its log file) is only set up once we know the script is really going to run
+CustomLogger().create_logger()
+logger.setLevel(logging.INFO)
+policy, spread, deadline = runOptionsFromArgs(args)
 
 csv_file = args.csv_file
+workers = max(args.workers, 1)
 
 ## XIQ API Setup
-if _XIQ_API_token:
-    x = XIQ(token=_XIQ_API_token)
-else:
-    print("Enter your XIQ login credentials")
-    username = input("Email: ")
-    password = getpass.getpass("Password: ")
-    x = XIQ(user_name=username,password = password)
+x = clientFromArgs(args, token=_XIQ_API_token, spread=spread, deadline=deadline)
 #OPTIONAL - use externally managed XIQ account
 if args.external:
+    import inquirer
     accounts, viqName = x.selectManagedAccount()
     if accounts == 1:
         question = [
@@ -52,10 +58,9 @@ if args.external:
             raise SystemExit
     elif accounts:
 
-        accounts_df = pd.DataFrame(accounts)
         count = 0
         options_list = []
-        for df_id, viq_info in accounts_df.iterrows():
+        for df_id, viq_info in enumerate(accounts):
             options_list.append(f"{df_id} - {viq_info['name']}")
             count = df_id
         current_viq = count + 1
@@ -77,12 +82,14 @@ if args.external:
         selection = int(selection)
 
         if selection != current_viq:
-            newViqID = (accounts_df.loc[selection,'id'])
-            newViqName = (accounts_df.loc[selection,'name'])
+            newViqID = accounts[selection]['id']
+            newViqName = accounts[selection]['name']
             x.switchAccount(newViqID, newViqName)
 
 
 def main():
+    import inquirer
+
 
     print("*****************************************************************")
     print("Please select which type of user groups you want to select from")
@@ -143,25 +150,15 @@ def main():
     Get all the user groups from XIQ based on above input and build into a list of dictionary
     '''
     # logging.info("Retrieving all User Groups from XIQ")
-    logging.info("Working...(page 1)")
-    response = x.getUserGroups(page=1, limit=_pageSize, type=ppsk_type)
-    logging.debug(f"Got Page 1 response: {response}")
-    total_pages = response.get("total_pages", 1)
-    group_list = response.get("data", [])
-
-    if total_pages > 1:
-        for pg in range(2, total_pages+1):
-            logging.info(f"Working...(page {pg} of {total_pages})")
-            response = x.getUserGroups(page=pg, limit=_pageSize, type=ppsk_type)
-            logging.debug(f"Got Page {pg} response: {response}")
-            group_list.extend(response.get("data", []))
+    # served from the local group catalog cache when it is fresh, see --group-cache-ttl / --refresh-groups
+    catalog = catalogFromArgs(x, args)
 
     groups_dict = defaultdict(lambda: defaultdict(int))
     '''
     Build new dictionary keyed on a local id number
     '''
     local_id = 1
-    for data_record in group_list:
+    for data_record in catalog.groups(type=ppsk_type):
         # print(type(data_record))
         groups_dict[local_id]["name"] = data_record.get("name")
         groups_dict[local_id]["id"] = data_record.get("id")
@@ -226,45 +223,35 @@ def main():
     gp_name = groups_dict[selection]["name"]
 
     logging.info(f"Retrieving users for group {gp_name}")
-    logging.info("Working...(page 1)")
-    response = x.getUsersByGroupID(usergroup_id, page=1, limit=_pageSize)
-    logging.debug(f"Got Page 1 response: {response}")
-    total_pages = response.get("total_pages", 1)
-    user_list = response.get("data", [])
-    total_users = int(response.get("total_count"))
+    total_users = x.getUserCount(usergroup_id)
     if total_users == 0:
         logging.error(f"User group {gp_name} does not appear to have any users.  The script will now exit")
         return
-    logging.info(f"There is a total of {total_users} records on {total_pages} pages")
-
-    if total_pages > 1:
-        for pg in range(2, total_pages + 1):
-            logging.info(f"Working...(page {pg} of {total_pages})")
-            response = x.getUsersByGroupID(usergroup_id, page=pg, limit=_pageSize)
-            logging.debug(f"Got Page {pg} response: {response}")
-            user_list.extend(response.get("data", []))
+    logging.info(f"There is a total of {total_users} records")
+
+    if args.plan:
+        checkpoint_file = args.checkpoint or csv_file + ".checkpoint"
+        completed = readCheckpoint(checkpoint_file).get(str(usergroup_id)) if args.resume else None
+        plan = planGroup(x, usergroup_id, workers=workers, policy=policy, completed=completed, limit=_pageSize,
+                         spread=spread)
+        logPlan(gp_name, plan, workers=workers, rate=args.rate_limit)
+        return
 
     '''
-    build dictionary keyed on xiq id
+    Users are streamed from XIQ page by page once an option is chosen, nothing is held in memory here
     '''
-    user_dict = defaultdict(lambda : defaultdict(int))
-    for data_record in user_list:
-        xiq_id = data_record.get("id")
-        user_dict[xiq_id]["user_name"] = data_record.get("user_name")
-        user_dict[xiq_id]["xiq_id"] = xiq_id
-        user_dict[xiq_id]["existing_pw"] = data_record.get("password")
     print("***************************************************************")
     print("Please read the following carefully and then choose an option")
     print("***************************************************************")
     print("\n")
-    print(f"There are {len(user_dict)} users in the group you have chosen.  By selecting proceed,\n"
+    print(f"There are {total_users} users in the group you have chosen.  By selecting proceed,\n"
           "the script will iterate through all of the users and generate new passwords.\n"
           "If email and/or SMS delivery notifications are enabled for the users, new notifications\n"
           "will be generated for each password change.\n"
           "\n"
           "\n"
           "Depending on the number of users in the group, the script may take several\n"
-          "minutes or longer to complete"
+          "minutes or longer to complete (run the script with --plan for an estimate)"
           )
     #
     # print("1 - Proceed with password change")
@@ -293,28 +280,24 @@ def main():
         return
     elif selection == 2:
         logging.info(f"User selected option 2 - write current files to CSV ({csv_file})")
-        field_names = [
-            "xiq_id",
-            "user_name",
-            "existing_pw",
-        ]
-        logging.info(f"Writing to csv file - {csv_file}")
-
-        with open(csv_file, mode="w", newline="") as file:
-            writer = csv.DictWriter(file, fieldnames=field_names)
-
-            # Write the header row
-            writer.writeheader()
-
-            # Write the data row
-            for id ,user_record in user_dict.items():
-                writer.writerow(user_record)
+        exportGroup(x, usergroup_id, csv_file, limit=_pageSize)
 
     elif selection == 1:
         logging.info("User selected option 1 - change all user passwords")
         print("******************************************")
+        # refuse before asking for confirmation, rather than after
+        if not (args.resume or args.force):
+            try:
+                checkNoEarlierRun(args.checkpoint or csv_file + ".checkpoint", usergroup_id)
+            except ValueError as e:
+                logging.error(e)
+                return
+        if policy is None:
+            scope = f"all {total_users} users"
+        else:
+            scope = f"the {policy.describe()} (out of {total_users} users)"
         print("Are you sure you want to continue?\n"
-              f"Typing 'y' below will proceed with password regeneration for all {len(user_dict)} users! "
+              f"Typing 'y' below will proceed with password regeneration for {scope}! "
               )
         print("******************************************")
         question = [
@@ -328,32 +311,23 @@ def main():
         elif selection:
             logging.info("Continuing with password regeneration")
 
-            for xiq_user_id in user_dict.keys():
-                usr = user_dict[xiq_user_id].get("user_name")
-                logging.info(f"Changing PPSK key for user: {usr}")
-                new_pw = x.postAPICall(f"/endusers/{xiq_user_id}/:regenerate-password")
-                user_dict[xiq_user_id]["new_pw"] = new_pw.get("password")
-                # print(f"NewPW={new_pw}")
-            logging.info(f"Writing to csv file - {csv_file}")
-            field_names = [
-                "xiq_id",
-                "user_name",
-                "existing_pw",
-                "new_pw",
-            ]
-
-            with open(csv_file, mode="w", newline="") as file:
-                writer = csv.DictWriter(file, fieldnames=field_names)
-
-                # Write the header row
-                writer.writeheader()
-
-                # Write the data row
-                for id, user_record in user_dict.items():
-                    writer.writerow(user_record)
+            # each row is journaled to disk as soon as its password has been regenerated,
+            # so an interrupted run keeps every password that was already changed and can be resumed
+            rotateGroup(x, usergroup_id, csv_file, workers=workers, checkpoint_file=args.checkpoint,
+                        resume=args.resume, limit=_pageSize, policy=policy, spread=spread,
+                        spread_batch=args.spread_batch, max_workers=args.adaptive_workers, verify=args.verify,
+                        force=args.force)
 
 
     # print("Im done")
 
 if __name__ == '__main__':
-    main()
+    try:
+        if args.schedule:
+            runScheduleFromArgs(x, args, workers=workers, limit=_pageSize)
+        elif isBatchMode(args):
+            runBatchFromArgs(x, args, workers=workers, limit=_pageSize)
+        else:
+            main()
+    finally:
+        finishRun(x, args)
@@ -0,0 +1,225 @@
+'''
+Local stand-in for the ExtremeCloud IQ API endpoints used by lib/xiq_api.py, for benchmarks and dry runs
+that must not touch a production tenant or regenerate real passwords.
+
+Endpoints: POST /login, GET /account/home, GET /account/external, POST /account/:switch,
+GET /usergroups, GET /endusers, POST /endusers/{id}/:regenerate-password, GET /devices,
+POST /devices/:onboard, GET /radio-profiles (+ channel-selection / radio-usage-opt).
+
+Users are generated on the fly from their index, so a 100k-user tenant costs no memory until
+passwords are regenerated. Latency, 5xx errors, 429s and a hard request-per-second quota are configurable.
+
+    python benchmarks/mock_xiq_server.py --port 8085 --groups 3 --users 10000 --latency-ms 40 --rate-429 0.01
+    python Rotate_PPSK_by_group.py --base-url http://127.0.0.1:8085 --groups "Group 1"
+'''
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+USER_ID_BASE = 1000000
+CREATE_TIME = "2024-01-01T00:00:00.000Z"
+
+
+class MockTenant:
+    '''Deterministic fake tenant: `groups` PPSK groups of `users` users each, plus `accounts` external VIQs.'''
+    def __init__(self, groups=3, users=1000, accounts=3):
+        self.groups = [{"id": 1000 + n, "name": f"Group {n}", "description": f"Mock PPSK group {n}",
+                        "password_db_location": "CLOUD" if n % 2 else "LOCAL"} for n in range(1, groups + 1)]
+        self.users_per_group = users
+        self.accounts = [{"id": 100 + n, "name": f"Customer {n}"} for n in range(1, accounts + 1)]
+        self.__rotated = {}
+        self.__lock = threading.Lock()
+
+    def user(self, group_id, index):
+        xiq_id = group_id * USER_ID_BASE + index
+        with self.__lock:
+            password, update_time = self.__rotated.get(xiq_id, (f"pw-{xiq_id}", CREATE_TIME))
+        return {"id": xiq_id, "user_group_id": group_id, "user_name": f"user{index}@group{group_id}",
+                "name": f"User {index}", "password": password, "create_time": CREATE_TIME, "update_time": update_time}
+
+    def regenerate(self, xiq_id):
+        group_id, index = divmod(xiq_id, USER_ID_BASE)
+        if not any(group["id"] == group_id for group in self.groups) or not 0 <= index < self.users_per_group:
+            return None
+        password = "".join(random.choice("abcdefghjkmnpqrstuvwxyz23456789") for _ in range(12))
+        with self.__lock:
+            self.__rotated[xiq_id] = (password, time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()))
+        return self.user(group_id, index)
+
+
+class MockFaults:
+    '''Injected latency and failures. Rates are probabilities per request; max_rps is a hard quota answered with 429.'''
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, rate_429=0.0, max_rps=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.max_rps = max_rps
+        self.__window = int(time.time())
+        self.__window_count = 0
+        self.__lock = threading.Lock()
+
+    def delay(self):
+        latency = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+    def over_quota(self):
+        if not self.max_rps:
+            return False
+        with self.__lock:
+            now = int(time.time())
+            if now != self.__window:
+                self.__window = now
+                self.__window_count = 0
+            self.__window_count += 1
+            return self.__window_count > self.max_rps
+
+
+def paged(records_total, page, limit, make_record):
+    limit = max(1, min(limit, 100))
+    total_pages = max((records_total + limit - 1) // limit, 1)
+    start = (page - 1) * limit
+    data = [make_record(i) for i in range(start, min(start + limit, records_total))]
+    return {"page": page, "count": len(data), "total_pages": total_pages, "total_count": records_total, "data": data}
+
+
+class MockXIQHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like the real API
+    disable_nagle_algorithm = True   # headers and body are written separately, don't let Nagle delay the body
+    tenant = None
+    faults = None
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def handle_request(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.stats["requests"] += 1
+        self.faults.delay()
+        if self.faults.over_quota() or random.random() < self.faults.rate_429:
+            self.stats["429"] += 1
+            return self.send_json(429, {"error_code": "TOO_MANY_REQUESTS", "error_message": "Rate limit exceeded"},
+                                  {"Retry-After": "1"})
+        if random.random() < self.faults.error_rate:
+            self.stats["5xx"] += 1
+            return self.send_json(503, {"error_code": "SERVICE_UNAVAILABLE", "error_message": "Mock failure"})
+
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        page = int(query.get("page", 1))
+        limit = int(query.get("limit", 10))
+        path = url.path
+
+        if method == "POST" and path == "/login":
+            return self.send_json(200, {"access_token": "mock-token", "token_type": "Bearer", "expires_in": 86400})
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self.send_json(401, {"error_code": "UNAUTHENTICATED", "error_message": "Missing bearer token"})
+
+        if method == "GET" and path == "/account/home":
+            # tokens from /account/:switch are "mock-token-<account id>"
+            account_id = self.headers["Authorization"].rsplit("-", 1)[-1]
+            for account in self.tenant.accounts:
+                if str(account["id"]) == account_id:
+                    return self.send_json(200, account)
+            return self.send_json(200, {"id": 1, "name": "Mock Home VIQ"})
+        if method == "GET" and path == "/account/external":
+            return self.send_json(200, self.tenant.accounts)
+        if method == "POST" and path == "/account/:switch":
+            return self.send_json(200, {"access_token": f"mock-token-{query.get('id')}", "token_type": "Bearer",
+                                        "expires_in": 86400})
+        if method == "GET" and path == "/usergroups":
+            groups = self.tenant.groups
+            if query.get("password_db_location"):
+                groups = [group for group in groups if group["password_db_location"] == query["password_db_location"]]
+            return self.send_json(200, paged(len(groups), page, limit, lambda i: groups[i]))
+        if method == "GET" and path == "/endusers":
+            group_id = int(query.get("user_group_ids", 0))
+            total = self.tenant.users_per_group if any(group["id"] == group_id for group in self.tenant.groups) else 0
+            return self.send_json(200, paged(total, page, limit, lambda i: self.tenant.user(group_id, i)))
+        match = re.fullmatch(r"/endusers/(\d+)/:regenerate-password", path)
+        if method == "POST" and match:
+            user = self.tenant.regenerate(int(match.group(1)))
+            if user is None:
+                return self.send_json(404, {"error_code": "NOT_FOUND", "error_message": "End user not found"})
+            self.stats["regenerated"] += 1
+            return self.send_json(200, user)
+        if method == "GET" and path == "/devices":
+            return self.send_json(200, {"page": 1, "count": 0, "total_pages": 1, "total_count": 0, "data": []})
+        if method == "POST" and path == "/devices/:onboard":
+            return self.send_json(202, {})
+        if method == "GET" and path == "/radio-profiles":
+            return self.send_json(200, paged(0, page, limit, lambda i: {}))
+        if method == "GET" and path.startswith("/radio-profiles/"):
+            return self.send_json(200, {"id": int(path.rsplit("/", 1)[-1] or 0)})
+        return self.send_json(404, {"error_code": "NOT_FOUND", "error_message": f"No mock for {method} {path}"})
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+
+def start_server(port=0, groups=3, users=1000, accounts=3, latency_ms=0, jitter_ms=0, error_rate=0.0, rate_429=0.0,
+                 max_rps=None):
+    '''Start the mock server on a background thread. Returns (server, base_url); stop it with server.shutdown().'''
+    handler = type("Handler", (MockXIQHandler,), {
+        "tenant": MockTenant(groups=groups, users=users, accounts=accounts),
+        "faults": MockFaults(latency_ms, jitter_ms, error_rate, rate_429, max_rps),
+        "stats": {"requests": 0, "429": 0, "5xx": 0, "regenerated": 0},
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.stats = handler.stats
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local mock of the XIQ API")
+    parser.add_argument('--port', type=int, default=8085, help='port to listen on (default 8085)')
+    parser.add_argument('--groups', type=int, default=3, help='number of PPSK user groups (default 3)')
+    parser.add_argument('--users', type=int, default=1000, help='users in each group, 10 to 100000 (default 1000)')
+    parser.add_argument('--accounts', type=int, default=3, help='number of external VIQ accounts (default 3)')
+    parser.add_argument('--latency-ms', dest='latency_ms', type=float, default=0, help='added latency per request')
+    parser.add_argument('--jitter-ms', dest='jitter_ms', type=float, default=0, help='random +/- jitter on the latency')
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0.0, help='probability of a 503 per request')
+    parser.add_argument('--rate-429', dest='rate_429', type=float, default=0.0, help='probability of a 429 per request')
+    parser.add_argument('--max-rps', dest='max_rps', type=int, default=None, help='hard requests/second quota, excess gets 429')
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.port, args.groups, args.users, args.accounts, args.latency_ms, args.jitter_ms,
+                                    args.error_rate, args.rate_429, args.max_rps)
+    print(f"Mock XIQ listening on {base_url} - {args.groups} groups x {args.users} users (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"Served: {server.stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+'''
+Startup-time benchmark for the lib package and the scripts.
+
+Measures, over several fresh interpreters, how long it takes to import lib and to run
+`Rotate_PPSK_by_group.py --help`, and checks that the heavy optional modules (pandas, colorlog,
+inquirer) are not pulled in by importing lib. Exits with status 1 if a budget is exceeded so it
+can be used to catch startup regressions:
+
+    python benchmarks/startup_benchmark.py --runs 10 --max-import-ms 250 --max-help-ms 600
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["pandas", "colorlog", "inquirer"]
+IMPORT_LIB = "import lib.xiq_api, lib.rotation, lib.batch"
+
+
+def time_command(command, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def heavy_modules_loaded():
+    check = f"{IMPORT_LIB}; import sys; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", check], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    return [module for module in output.stdout.strip().split(",") if module]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure lib import and script --help startup time")
+    parser.add_argument('--runs', type=int, default=10, help='number of fresh interpreters per measurement (default 10)')
+    parser.add_argument('--max-import-ms', type=float, default=250, help='budget for the median lib import time (default 250)')
+    parser.add_argument('--max-help-ms', type=float, default=600, help='budget for the median --help time (default 600)')
+    args = parser.parse_args()
+
+    baseline = time_command([sys.executable, "-c", "pass"], args.runs)
+    lib_import = time_command([sys.executable, "-c", IMPORT_LIB], args.runs)
+    script_help = time_command([sys.executable, "Rotate_PPSK_by_group.py", "--help"], args.runs)
+    heavy = heavy_modules_loaded()
+
+    failures = []
+    print(f"{'measurement':<28}{'median ms':>10}{'min ms':>10}{'max ms':>10}")
+    for name, timings, budget in [("interpreter (python -c pass)", baseline, None),
+                                  ("import lib", lib_import, args.max_import_ms),
+                                  ("Rotate_PPSK_by_group --help", script_help, args.max_help_ms)]:
+        median = statistics.median(timings)
+        print(f"{name:<28}{median:>10.1f}{min(timings):>10.1f}{max(timings):>10.1f}")
+        if budget is not None and median > budget:
+            failures.append(f"{name} median {median:.1f}ms is over the {budget:.0f}ms budget")
+    if heavy:
+        failures.append(f"importing lib loaded heavy modules: {', '.join(heavy)}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        raise SystemExit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+'''
+End-to-end throughput benchmark. Starts the local mock XIQ server (mock_xiq_server.py) and drives the
+real code against it for each tenant size:
+
+    listing - lib only, stream every user of the group (XIQ.iterUsersByGroupID)
+    export  - Rotate_PPSK_by_group.py batch export of the group to csv
+    rotate  - Rotate_PPSK_by_group.py batch rotation of the group
+
+and reports users/sec, wall time and peak RSS of the process doing the work.
+
+    python benchmarks/throughput_benchmark.py --sizes 10,1000,10000 --latency-ms 30 --workers 8
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_xiq_server import start_server
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(REPO_DIR, "Rotate_PPSK_by_group.py")
+GROUP_NAME = "Group 1"
+GROUP_ID = 1001
+
+LISTING_SNIPPET = (
+    "import sys; from lib.xiq_api import XIQ; "
+    "x = XIQ(token='mock-token', base_url=sys.argv[1], page_workers=int(sys.argv[3])); "
+    "print(sum(1 for _ in x.iterUsersByGroupID(int(sys.argv[2]))))"
+)
+
+
+def run_measured(command, cwd, env):
+    '''Run command to completion. Returns (wall seconds, peak rss MB, exit status).'''
+    start = time.perf_counter()
+    with open(os.path.join(cwd, "benchmark_output.txt"), "a") as output:
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdout=output, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - start
+    # ru_maxrss is KB on Linux and bytes on macOS
+    peak_rss = rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return wall, peak_rss, process.returncode
+
+
+def scenario_command(scenario, base_url, work_dir, args):
+    if scenario == "listing":
+        return [sys.executable, "-c", LISTING_SNIPPET, base_url, str(GROUP_ID), str(args.page_workers)]
+    command = [sys.executable, SCRIPT, "--base-url", base_url, "--no-token-cache", "--groups", GROUP_NAME,
+               "--csv_file", os.path.join(work_dir, f"{scenario}.csv"), "--workers", str(args.workers)]
+    if scenario == "rotate":
+        command += ["--action", "rotate", "--yes"]
+    return command
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark listing, export and rotation against a mock XIQ")
+    parser.add_argument('--sizes', default="10,1000,10000", help='comma separated users per group (default 10,1000,10000)')
+    parser.add_argument('--scenarios', default="listing,export,rotate", help='comma separated scenarios to run')
+    parser.add_argument('--workers', type=int, default=8, help='--workers passed to the script for rotation (default 8)')
+    parser.add_argument('--page-workers', dest='page_workers', type=int, default=8, help='concurrent page fetches for listing (default 8)')
+    parser.add_argument('--latency-ms', dest='latency_ms', type=float, default=20, help='mock latency per request (default 20)')
+    parser.add_argument('--jitter-ms', dest='jitter_ms', type=float, default=5, help='mock latency jitter (default 5)')
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0.0, help='mock 503 probability')
+    parser.add_argument('--rate-429', dest='rate_429', type=float, default=0.0, help='mock 429 probability')
+    parser.add_argument('--max-rps', dest='max_rps', type=int, default=None, help='mock requests/second quota')
+    parser.add_argument('--json', default=None, help='optional file to write the results to as json')
+    args = parser.parse_args()
+
+    env = dict(os.environ, XIQ_API_TOKEN="mock-token", PYTHONPATH=REPO_DIR)
+    results = []
+    print(f"{'users':>8} {'scenario':<9}{'wall s':>9}{'users/s':>10}{'peak MB':>9}  status")
+    for size in [int(size) for size in args.sizes.split(",")]:
+        server, base_url = start_server(groups=1, users=size, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                        error_rate=args.error_rate, rate_429=args.rate_429, max_rps=args.max_rps)
+        try:
+            with tempfile.TemporaryDirectory() as work_dir:
+                for scenario in args.scenarios.split(","):
+                    wall, peak_rss, status = run_measured(scenario_command(scenario, base_url, work_dir, args),
+                                                          work_dir, env)
+                    result = {"users": size, "scenario": scenario, "wall_seconds": round(wall, 3),
+                              "users_per_second": round(size / wall, 1), "peak_rss_mb": round(peak_rss, 1),
+                              "exit_status": status}
+                    results.append(result)
+                    print(f"{size:>8} {scenario:<9}{wall:>9.2f}{size / wall:>10.1f}{peak_rss:>9.1f}  "
+                          f"{'ok' if status == 0 else f'exit {status}'}")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
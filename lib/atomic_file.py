@@ -0,0 +1,18 @@
+import os
+import threading
+
+
+def atomicWrite(path, text, mode=None):
+    '''
+    Replace path with text so readers (another run, node-exporter, a resumed rotation) only ever see the old
+    or the new content, never a half written file. With mode (ex. 0o600 for tokens) the file is created with
+    those permissions and a missing parent folder is made private to the current user (0700).
+    '''
+    folder = os.path.dirname(path)
+    if mode is not None and folder and not os.path.exists(folder):
+        os.makedirs(folder, mode=0o700)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666 if mode is None else mode)
+    with os.fdopen(fd, "w") as file:
+        file.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,338 @@
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.rotation import exportGroup, exportGroups, rotateGroup
+from lib.group_catalog import GroupCatalog, catalogFromArgs
+from lib.policy import policyFromArgs
+from lib.checkpoint import readCheckpoint
+from lib.planner import planGroup, logPlan, combinePlans
+from lib.pacing import spreadFromArgs
+
+
+def addBatchArguments(parser):
+    parser.add_argument('--groups', default=None, help='Optional - comma separated user group names to process without prompting (headless batch mode)')
+    parser.add_argument('--group-ids', dest='group_ids', default=None, help='Optional - comma separated user group ids to process without prompting (headless batch mode)')
+    parser.add_argument('--all-groups', dest='all_groups', action="store_true", help='Optional - process every user group of the --type instead of naming them (ex. nightly snapshot of all groups)')
+    parser.add_argument('--type', choices=['cloud', 'local', 'all'], default='all', help='PPSK group type searched when resolving --groups or listed by --all-groups (default all)')
+    parser.add_argument('--action', choices=['export', 'rotate'], default='export', help='batch mode action - export current passwords or rotate them (default export)')
+    parser.add_argument('--single-file', dest='single_file', action="store_true", help='Optional - with --action export write every group to --csv_file (with group_id/group_name columns) instead of one file per group')
+    parser.add_argument('--group-workers', dest='group_workers', type=int, default=4, help='number of groups processed in parallel in batch mode (default 4)')
+    parser.add_argument('--accounts', default=None, help='Optional - comma separated external VIQ names to run the batch in, each with its own session')
+    parser.add_argument('--all-accounts', dest='all_accounts', action="store_true", help='Optional - run the batch in every external VIQ this login can access')
+    parser.add_argument('--account-workers', dest='account_workers', type=int, default=4, help='number of external VIQs processed in parallel (default 4)')
+    parser.add_argument('--yes', action="store_true", help='confirm password rotation in batch mode without prompting')
+
+
+def isBatchMode(args):
+    return bool(args.groups or args.group_ids or args.all_groups or args.accounts or args.all_accounts)
+
+
+def isAccountFanOut(args):
+    return bool(args.accounts or args.all_accounts)
+
+
+def splitList(value):
+    if not value:
+        return []
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def groupCsvFile(csv_file, group_name, group_id):
+    '''
+    user_password_list.csv + "Guest Users" (id 1234) -> user_password_list_Guest_Users_1234.csv
+    The id keeps names that only differ in punctuation (ex. "Guests/Staff" and "Guests Staff") in separate files.
+    '''
+    stem, ext = os.path.splitext(csv_file)
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", str(group_name)).strip("_")
+    return f"{stem}_{safe_name}_{group_id}{ext or '.csv'}"
+
+
+def resolveGroups(catalog, names=None, ids=None, type=None):
+    '''
+    Look up the requested groups by name and/or id in the user group catalog (see lib/group_catalog.py).
+    A cached catalog is refreshed once if a group is not found, in case it was created since.
+    Returns a list of group records (name, id, password_db_location). Raises ValueError for unknown groups.
+    '''
+    names = names or []
+    ids = [str(group_id) for group_id in (ids or [])]
+
+    def lookup():
+        allowed = None if type is None else {str(group["id"]) for group in catalog.groups(type=type)}
+        found = [catalog.byName(name) for name in names] + [catalog.byId(group_id) for group_id in ids]
+        return [group if group is not None and (allowed is None or str(group["id"]) in allowed) else None
+                for group in found]
+
+    found = lookup()
+    if None in found and catalog.isCached():
+        catalog.refresh()
+        found = lookup()
+    missing = [wanted for wanted, group in zip(names + ids, found) if group is None]
+    if missing:
+        raise ValueError(f"User groups not found in XIQ: {', '.join(missing)}")
+    groups = []
+    seen = set()
+    for group in found:
+        if group.get("id") not in seen:
+            seen.add(group.get("id"))
+            groups.append(group)
+    return groups
+
+
+def runBatch(x, groups, action, csv_file, workers=1, group_workers=4, resume=False, limit=100, policy=None,
+             spread=None, spread_batch=1, max_workers=None, verify=False, single_file=False, stop=None, force=False):
+    '''
+    Export, rotate or plan (dry run, see lib/planner.py) several groups with one authenticated XIQ client. Groups are processed concurrently
+    (group_workers at a time) and each group is written to its own csv file (see groupCsvFile), or with
+    single_file every exported group goes to csv_file itself (see exportGroups).
+    A failing group does not stop the others. With spread every group is paced over the same window.
+    With verify every rotated group is re-read and checked against XIQ (see lib/verify.py).
+    A group whose checkpoint records an earlier run fails unless resume or force is given (see rotateGroup).
+    stop (threading.Event) is shared by every group; it is set on Ctrl-C, so groups not started yet are
+    dropped and running ones stop at their next user instead of rotating the rest of the group.
+    Returns {group id: result dict}, every result carrying its group_name.
+    '''
+    stop = stop or threading.Event()
+    if single_file and action == "export":
+        return exportGroups(x, groups, csv_file, group_workers=group_workers, limit=limit, stop=stop)
+
+    def run_group(group):
+        group_name = group.get("name")
+        group_csv = groupCsvFile(csv_file, group_name, group.get("id"))
+        if action != "plan":
+            logging.info(f"Starting {action} of group {group_name} -> {group_csv}")
+        try:
+            if action == "rotate":
+                summary = rotateGroup(x, group.get("id"), group_csv, workers=workers, resume=resume, limit=limit,
+                                      policy=policy, spread=spread, spread_batch=spread_batch,
+                                      max_workers=max_workers, verify=verify, stop=stop, force=force)
+            elif action == "plan":
+                completed = readCheckpoint(group_csv + ".checkpoint").get(str(group.get("id"))) if resume else None
+                summary = planGroup(x, group.get("id"), workers=workers, policy=policy, completed=completed,
+                                    limit=limit, spread=spread)
+            else:
+                summary = {"exported": exportGroup(x, group.get("id"), group_csv, limit=limit, stop=stop)}
+        except (Exception, SystemExit) as e:
+            logging.error(f"Failed to {action} group {group_name}: {e!r}")
+            return {"group_name": group_name, "status": "failed", "csv_file": group_csv}
+        # users that could not be rotated (or whose new password XIQ does not hold) are listed in the group's
+        # failures and verify files
+        partial = summary.get("failed") or summary.get("mismatched")
+        summary.update({"group_name": group_name, "status": "partial" if partial else "ok", "csv_file": group_csv})
+        return summary
+
+    return runStoppable(run_group, groups, group_workers, stop, "groups", lambda group: group.get("id"))
+
+
+def logBatchSummary(results):
+    logging.info("************ Batch summary ************")
+    for result in results.values():
+        details = ", ".join(f"{key}={value}" for key, value in result.items()
+                            if key not in ("group_name", "status", "csv_file"))
+        logging.info(f"{result['group_name']}: {result['status']} {details} ({result['csv_file']})")
+
+
+def runStoppable(function, items, max_workers, stop, label, key):
+    '''
+    {key(item): function(item)} with max_workers items running at once. On Ctrl-C (or any error) stop is set and
+    the items not started are cancelled; the running ones are waited for, they end at their next user once
+    stop is set and journal the calls already sent, then the error is raised again.
+    '''
+    results = {}
+    executor = ThreadPoolExecutor(max_workers=max(min(max_workers, len(items)), 1))
+    try:
+        futures = [executor.submit(function, item) for item in items]
+        for item, future in zip(items, futures):
+            results[key(item)] = future.result()
+    except BaseException:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        logging.warning(f"Stopping, waiting for the running {label} to save their results")
+        executor.shutdown(wait=True)
+        raise
+    executor.shutdown()
+    return results
+
+
+def selectAccounts(x, names=None):
+    '''
+    Return the external accounts ({"id", "name"}) to fan out to - every account when names is empty.
+    Raises ValueError for unknown account names.
+    '''
+    response = x.selectManagedAccount()
+    accounts = response[0] if response != 1 else []
+    if not names:
+        return accounts
+    by_name = {account.get("name"): account for account in accounts}
+    missing = [name for name in names if name not in by_name]
+    if missing:
+        raise ValueError(f"External accounts not found: {', '.join(missing)}")
+    return [by_name[name] for name in names]
+
+
+def runAccounts(x, accounts, group_names, action, csv_file, workers=1, group_workers=4, account_workers=4,
+                ppsk_type=None, resume=False, limit=100, catalog_options=None, policy=None, spread=None, spread_batch=1,
+                max_workers=None, verify=False, all_groups=False, single_file=False, stop=None, force=False):
+    '''
+    Run the same batch in several external VIQs concurrently. Every account gets its own XIQ client
+    (token from /account/:switch and its own connection pool); only the home client's TokenBucket is shared,
+    so all accounts together stay within one request rate budget.
+    Groups are looked up by name in each account (or every group of ppsk_type with all_groups) and written to
+    <csv_file>_<account>_<account id>_<group>_<group id>.csv, or <csv_file>_<account>_<account id>.csv with single_file.
+    catalog_options are passed to each account's GroupCatalog (cache_file, ttl, refresh).
+    stop (threading.Event) is shared by every account's batch and set on Ctrl-C (see runBatch).
+    Returns {account id: summary dict}, every summary carrying its account_name.
+    '''
+    stop = stop or threading.Event()
+
+    def run_account(account):
+        account_name = account.get("name")
+        summary = {"account_name": account_name, "status": "ok", "groups_ok": 0, "groups_failed": 0, "users": 0}
+        account_x = None
+        try:
+            # every account draws from the login's --rate-limit budget instead of getting its own
+            account_x = x.forAccount(account.get("id"), account_name, rate_limiter=x.rate_limiter)
+            catalog = GroupCatalog(account_x, limit=limit, **(catalog_options or {}))
+            if all_groups:
+                groups = catalog.groups(type=ppsk_type)
+            else:
+                groups = resolveGroups(catalog, names=group_names, type=ppsk_type)
+            account_csv = groupCsvFile(csv_file, account_name, account.get("id"))
+            results = runBatch(account_x, groups, action, account_csv, workers=workers,
+                               group_workers=group_workers, resume=resume, limit=limit, policy=policy, spread=spread,
+                               spread_batch=spread_batch, max_workers=max_workers, verify=verify,
+                               single_file=single_file, stop=stop, force=force)
+        except (Exception, SystemExit) as e:
+            logging.error(f"Failed to {action} in account {account_name}: {e!r}")
+            summary["status"] = "failed"
+            return summary
+        finally:
+            # closing hands the account's connection stats to x for the end of run report
+            if account_x is not None:
+                account_x.close()
+        for result in results.values():
+            if result["status"] != "failed":
+                summary["groups_ok"] += 1
+                summary["users"] += result.get("rotated", result.get("exported", result.get("due", 0)))
+            else:
+                summary["groups_failed"] += 1
+        if summary["groups_failed"]:
+            summary["status"] = "partial"
+        summary["groups"] = results
+        return summary
+
+    return runStoppable(run_account, accounts, account_workers, stop, "accounts", lambda account: account.get("id"))
+
+
+def logAccountSummary(results):
+    logging.info("************ Account summary ************")
+    for summary in results.values():
+        logging.info(f"{summary['account_name']}: {summary['status']} - {summary['groups_ok']} groups ok, "
+                     f"{summary['groups_failed']} groups failed, {summary['users']} users")
+
+
+def logBatchPlan(results, workers=1, group_workers=1, rate=None, prefix=""):
+    '''Log the plan of every group and their total. Returns the total plan, None if no group could be planned.'''
+    plans = []
+    for result in results.values():
+        if result["status"] == "ok":
+            logPlan(prefix + result["group_name"], result, workers=workers, rate=rate)
+            plans.append(result)
+        else:
+            logging.error(f"{prefix}{result['group_name']}: could not be planned")
+    if not plans:
+        return None
+    total = combinePlans(plans, group_workers=group_workers, rate=rate)
+    if len(plans) > 1:
+        logPlan(f"{prefix}all {len(plans)} groups", total, workers=workers, rate=rate)
+    return total
+
+
+def logAccountPlan(results, workers=1, group_workers=1, account_workers=1, rate=None):
+    '''Log the group plans of every account (see runAccounts) and the total over all accounts.'''
+    totals = []
+    for summary in results.values():
+        if summary["status"] == "failed":
+            logging.error(f"{summary['account_name']}: could not be planned")
+            continue
+        total = logBatchPlan(summary["groups"], workers=workers, group_workers=group_workers, rate=rate,
+                             prefix=f"{summary['account_name']} / ")
+        if total is not None:
+            totals.append(total)
+    if len(totals) > 1:
+        logPlan(f"all {len(totals)} accounts", combinePlans(totals, group_workers=account_workers, rate=rate),
+                workers=workers, rate=rate)
+
+
+def runBatchFromArgs(x, args, workers=1, limit=100):
+    '''Entry point used by the scripts when --groups or --group-ids is given.'''
+    # --plan turns the batch into a dry run of the rotation
+    action = "plan" if args.plan else args.action
+    if not (args.groups or args.group_ids or args.all_groups):
+        logging.error("Batch mode needs the groups to process, use --groups and/or --group-ids, or --all-groups")
+        raise SystemExit(1)
+    if args.all_groups and (args.groups or args.group_ids):
+        logging.error("--all-groups cannot be combined with --groups/--group-ids")
+        raise SystemExit(1)
+    if args.single_file and action != "export":
+        logging.error("--single-file is only available with --action export")
+        raise SystemExit(1)
+    if action == "rotate" and not args.yes:
+        logging.error("Batch password rotation requires --yes to confirm, exiting...")
+        raise SystemExit(1)
+    ppsk_type = None if args.type == "all" else args.type
+    try:
+        policy = policyFromArgs(args)
+        spread = spreadFromArgs(args)
+    except ValueError as e:
+        logging.error(e)
+        raise SystemExit(1)
+    if isAccountFanOut(args):
+        if args.group_ids:
+            logging.error("--group-ids cannot be used with --accounts/--all-accounts, group ids differ per account. Use --groups")
+            raise SystemExit(1)
+        try:
+            accounts = selectAccounts(x, names=splitList(args.accounts))
+        except ValueError as e:
+            logging.error(e)
+            raise SystemExit(1)
+        results = runAccounts(x, accounts, splitList(args.groups), action, args.csv_file, workers=workers,
+                              group_workers=args.group_workers, account_workers=args.account_workers,
+                              ppsk_type=ppsk_type, resume=args.resume, limit=limit,
+                              catalog_options={"cache_file": args.group_cache, "ttl": args.group_cache_ttl,
+                                               "refresh": args.refresh_groups},
+                              policy=policy, spread=spread, spread_batch=args.spread_batch,
+                              max_workers=args.adaptive_workers, verify=args.verify, all_groups=args.all_groups,
+                              single_file=args.single_file, force=args.force)
+        if action == "plan":
+            rate = x.rate_limiter.rate if x.rate_limiter is not None else None
+            logAccountPlan(results, workers=workers, group_workers=args.group_workers,
+                           account_workers=args.account_workers, rate=rate)
+        else:
+            logAccountSummary(results)
+        return results
+    try:
+        catalog = catalogFromArgs(x, args)
+        if args.all_groups:
+            groups = catalog.groups(type=ppsk_type)
+        else:
+            groups = resolveGroups(catalog, names=splitList(args.groups), ids=splitList(args.group_ids),
+                                   type=ppsk_type)
+    except ValueError as e:
+        logging.error(e)
+        raise SystemExit(1)
+    if not groups:
+        logging.error("No user groups found in XIQ, nothing to do")
+        raise SystemExit(1)
+    results = runBatch(x, groups, action, args.csv_file, workers=workers, group_workers=args.group_workers,
+                       resume=args.resume, limit=limit, policy=policy, spread=spread, spread_batch=args.spread_batch,
+                       max_workers=args.adaptive_workers, verify=args.verify, single_file=args.single_file,
+                       force=args.force)
+    if action == "plan":
+        rate = x.rate_limiter.rate if x.rate_limiter is not None else None
+        logBatchPlan(results, workers=workers, group_workers=args.group_workers, rate=rate)
+    else:
+        logBatchSummary(results)
+    return results
@@ -0,0 +1,78 @@
+import json
+import os
+import time
+
+
+def readCheckpoint(path):
+    '''Completed end-user ids per group id ({str: set of str}) from a checkpoint file, without opening it for writing.'''
+    completed = {}
+    if not os.path.exists(path):
+        return completed
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # a torn last line from a crash, everything before it is still valid
+                continue
+            completed.setdefault(str(entry.get("group_id")), set()).add(str(entry.get("xiq_id")))
+    return completed
+
+
+def checkNoEarlierRun(path, group_id):
+    '''
+    Raise ValueError when the checkpoint at path records users of group_id: a new (not resumed) rotation would
+    truncate it and its csv file, losing the passwords an earlier run already changed.
+    '''
+    completed = readCheckpoint(path).get(str(group_id))
+    if completed:
+        raise ValueError(f"{path} records {len(completed)} users of group {group_id} rotated by an earlier run - "
+                         f"use --resume to finish that run, or --force to start a new rotation and overwrite its csv file")
+
+
+class Checkpoint:
+    '''
+    Append-only journal of the users a rotation has completed, one json object per line:
+        {"group_id": 1234, "xiq_id": 5678, "time": 1700000000}
+    Entries are keyed on the XIQ user group id and end-user id, so a rerun with --resume can skip
+    every user that was already regenerated. Records are held until commit() is called, which the
+    rotation does right after the matching csv rows are on disk - a user is never marked done
+    without its new password having been saved.
+    '''
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.__pending = []
+        self.__completed = readCheckpoint(path) if resume else {}
+        self.__file = open(path, mode="a" if resume else "w")
+
+    def completed(self, group_id):
+        return self.__completed.get(str(group_id), set())
+
+    def isCompleted(self, group_id, xiq_id):
+        return str(xiq_id) in self.completed(group_id)
+
+    def record(self, group_id, xiq_id):
+        self.__pending.append({"group_id": group_id, "xiq_id": xiq_id, "time": int(time.time())})
+
+    def commit(self):
+        if not self.__pending or self.__file.closed:
+            return
+        for entry in self.__pending:
+            self.__file.write(json.dumps(entry) + "\n")
+        self.__pending = []
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+    def close(self):
+        if not self.__file.closed:
+            self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,80 @@
+import logging
+import threading
+import time
+
+
+class CircuitBreaker:
+    '''
+    Stops hammering a degraded XIQ backend. After `threshold` consecutive failures (5xx, timeouts, connection
+    errors) the circuit opens: every caller pauses in before() instead of sending requests. Once `cooldown`
+    seconds have passed a single probe request is let through (half-open); if it succeeds the circuit closes
+    and the paused callers continue, if it fails the circuit opens again for twice as long (up to max_cooldown).
+    One breaker can be shared by several XIQ clients talking to the same API.
+    '''
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, threshold=20, cooldown=30.0, max_cooldown=300.0):
+        self.threshold = max(int(threshold), 1)
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = self.CLOSED
+        self.opened = 0
+        self.__cooldown = cooldown
+        self.__failures = 0
+        self.__reopen_at = 0.0
+        self.__probing = False
+        self.__condition = threading.Condition()
+
+    def before(self, timeout=None):
+        '''
+        Wait until a request may be sent. Returns False if the circuit is still open after timeout seconds
+        (ex. the time left before the run deadline), True otherwise.
+        '''
+        give_up = None if timeout is None else time.monotonic() + timeout
+        with self.__condition:
+            while True:
+                if self.state == self.CLOSED:
+                    return True
+                now = time.monotonic()
+                if self.state == self.OPEN and now >= self.__reopen_at:
+                    self.state = self.HALF_OPEN
+                    self.__probing = False
+                if self.state == self.HALF_OPEN and not self.__probing:
+                    self.__probing = True
+                    logging.info("Circuit breaker half-open, sending a probe request")
+                    return True
+                if give_up is not None and now >= give_up:
+                    return False
+                wake = self.__reopen_at if self.state == self.OPEN else now + 1.0
+                if give_up is not None:
+                    wake = min(wake, give_up)
+                self.__condition.wait(max(wake - now, 0.01))
+
+    def success(self):
+        with self.__condition:
+            self.__failures = 0
+            if self.state != self.CLOSED:
+                logging.info("Circuit breaker closed, XIQ is answering again")
+                self.state = self.CLOSED
+                self.__cooldown = self.base_cooldown
+                self.__probing = False
+                self.__condition.notify_all()
+
+    def failure(self):
+        with self.__condition:
+            self.__failures += 1
+            if self.state == self.HALF_OPEN:
+                self.__cooldown = min(self.__cooldown * 2, self.max_cooldown)
+                self.__open("probe request failed")
+            elif self.state == self.CLOSED and self.__failures >= self.threshold:
+                self.__open(f"{self.__failures} consecutive failures")
+
+    def __open(self, reason):
+        self.state = self.OPEN
+        self.opened += 1
+        self.__probing = False
+        self.__reopen_at = time.monotonic() + self.__cooldown
+        logging.warning(f"Circuit breaker open ({reason}), pausing XIQ requests for {self.__cooldown:g}s")
+        self.__condition.notify_all()
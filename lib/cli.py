@@ -0,0 +1,107 @@
+import getpass
+import logging
+
+from lib.xiq_api import XIQ, logger
+from lib.token_cache import TokenCache, DEFAULT_CACHE_FILE
+from lib.batch import addBatchArguments, isBatchMode
+from lib.group_catalog import addCatalogArguments
+from lib.policy import addPolicyArguments, policyFromArgs, parseDuration
+from lib.circuit import CircuitBreaker
+from lib.scheduler import addScheduleArguments, SCHEDULE_RATE_LIMIT
+from lib.pacing import addPacingArguments, spreadFromArgs
+
+# an export is only listings, each fetching up to this many pages at once (XIQ page_workers)
+PAGE_WORKERS = 8
+
+
+def addCommonArguments(parser):
+    '''Every flag shared by Rotate_PPSK_by_group.py and Rotate_PPSK_by_group_inquirer.py.'''
+    parser.add_argument('--external',action="store_true", help="Optional - adds External Account selection, to use an external VIQ")
+    parser.add_argument('--csv_file', default='user_password_list.csv', help='name of csv file to create')
+    parser.add_argument('--resume', action="store_true", help='Optional - skip users already rotated by an interrupted run and append to its csv file')
+    parser.add_argument('--force', action="store_true", help='Optional - start a new rotation even though the checkpoint records users rotated by an earlier run, replacing its csv file')
+    parser.add_argument('--plan', action="store_true", help='Optional - dry run, count the users and API calls a rotation would make and estimate its duration without regenerating anything')
+    parser.add_argument('--checkpoint', default=None, help='checkpoint file used by --resume (default <csv_file>.checkpoint)')
+    parser.add_argument('--workers', type=int, default=4, help='number of passwords to regenerate in parallel (default 4)')
+    parser.add_argument('--verify', action="store_true", help='Optional - after rotating, re-read the group and check that XIQ holds every new password (mismatches, missing and added users go to <csv_file>.verify.json)')
+    parser.add_argument('--adaptive-workers', dest='adaptive_workers', type=int, default=None, help='Optional - adapt the number of parallel regenerations between 1 and this maximum (starting at --workers), backing off on 429s, 5xx errors and rising latency')
+    parser.add_argument('--rate-limit', dest='rate_limit', type=float, default=None, help='Optional - max XIQ API requests per second (client side), retries back off on 429/5xx either way')
+    parser.add_argument('--connect-timeout', dest='connect_timeout', type=float, default=10, help='seconds to wait for a connection to XIQ (default 10)')
+    parser.add_argument('--read-timeout', dest='read_timeout', type=float, default=60, help='seconds to wait for an XIQ response (default 60)')
+    parser.add_argument('--deadline', default=None, help='Optional - stop sending requests this long after the script starts (ex. 2h), resume the rest later with --resume')
+    parser.add_argument('--breaker-threshold', dest='breaker_threshold', type=int, default=20, help='consecutive 5xx errors/timeouts that pause all XIQ requests (default 20)')
+    parser.add_argument('--breaker-cooldown', dest='breaker_cooldown', type=float, default=30, help='seconds requests are paused before a probe request is sent (default 30, doubled each time the probe fails)')
+    parser.add_argument('--base-url', dest='base_url', default=XIQ.DEFAULT_URL, help=f'XIQ API url (default {XIQ.DEFAULT_URL}), ex. a local mock server for benchmarks')
+    parser.add_argument('--username', default=None, help='Optional - XIQ login email, skips the prompt')
+    parser.add_argument('--token-cache', dest='token_cache', default=DEFAULT_CACHE_FILE, help=f'file caching the XIQ token and account list between runs (default {DEFAULT_CACHE_FILE})')
+    parser.add_argument('--no-token-cache', dest='no_token_cache', action="store_true", help='Optional - always log in and never write the token cache')
+    parser.add_argument('--metrics-json', dest='metrics_json', default=None, help='Optional - write per-endpoint API call metrics to this json file at the end of the run')
+    parser.add_argument('--metrics-prom', dest='metrics_prom', default=None, help='Optional - write the API call metrics as a Prometheus textfile (node-exporter textfile collector)')
+    addBatchArguments(parser)
+    addCatalogArguments(parser)
+    addPolicyArguments(parser)
+    addPacingArguments(parser)
+    addScheduleArguments(parser)
+
+
+def runOptionsFromArgs(args):
+    '''(policy, spread seconds, deadline seconds) from the flags, exits on an invalid value. Also defaults --rate-limit for --schedule.'''
+    try:
+        policy = policyFromArgs(args)
+        spread = spreadFromArgs(args)
+        deadline = parseDuration(args.deadline) if args.deadline else None
+    except ValueError as e:
+        logging.error(e)
+        raise SystemExit(1)
+    if args.schedule and args.rate_limit is None:
+        # the daemon's jobs, in every account, must never add up to more than one request budget
+        args.rate_limit = SCHEDULE_RATE_LIMIT
+        logging.info(f"No --rate-limit given, scheduled jobs share {SCHEDULE_RATE_LIMIT} requests per second")
+    return policy, spread, deadline
+
+
+def poolSizeFromArgs(args):
+    '''Connections to keep open to XIQ: enough for every call the run can have in flight at once.'''
+    # the most regenerate calls that can be in flight for one group
+    concurrency = max(args.workers, 1, args.adaptive_workers or 0)
+    if isBatchMode(args) and args.action == "export":
+        concurrency = max(concurrency, PAGE_WORKERS)
+    # batch mode runs several groups at once and the scheduler several jobs, each with its own workers
+    if args.schedule:
+        return max(concurrency * max(args.job_workers, 1), 10)
+    return max(concurrency * (max(args.group_workers, 1) if isBatchMode(args) else 1), 10)
+
+
+def clientFromArgs(args, token=None, spread=None, deadline=None):
+    '''
+    The XIQ client for this run: from a bearer token when one is given, otherwise from a login (prompting for
+    the email and password, or reusing a cached token).
+    '''
+    options = {"pool_maxsize": poolSizeFromArgs(args), "page_workers": PAGE_WORKERS, "rate_limit": args.rate_limit,
+               "base_url": args.base_url, "timeout": (args.connect_timeout, args.read_timeout), "deadline": deadline,
+               "circuit_breaker": CircuitBreaker(threshold=args.breaker_threshold, cooldown=args.breaker_cooldown)}
+    if token:
+        return XIQ(token=token, **options)
+    token_cache = None if args.no_token_cache else TokenCache(args.token_cache)
+    print("Enter your XIQ login credentials")
+    username = args.username or input("Email: ")
+    # a valid cached token for this login means the password is only asked for if XIQ rejects the token,
+    # except for runs that outlive the token and may have no one at the terminal by then
+    cached = token_cache is not None and token_cache.getToken(TokenCache.loginKey(args.base_url.rstrip('/'), username))
+    if cached and not (args.schedule or spread):
+        password = None
+    else:
+        password = getpass.getpass("Password: ")
+    return XIQ(user_name=username, password=password, token_cache=token_cache,
+               password_prompt=lambda: getpass.getpass("XIQ token was rejected, password: "), **options)
+
+
+def finishRun(x, args):
+    '''Connection and API metrics logged (and written with --metrics-json/--metrics-prom) at the end of every run.'''
+    x.logConnectionStats()
+    x.metrics.logSummary(logger)
+    if args.metrics_json:
+        x.metrics.writeJson(args.metrics_json, extra={"connections": x.getConnectionStats(),
+                                                      "account_connections": x.account_connections})
+    if args.metrics_prom:
+        x.metrics.writePrometheus(args.metrics_prom)
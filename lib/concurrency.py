@@ -0,0 +1,86 @@
+import logging
+import threading
+
+from lib.retry import isRetryableStatus
+
+
+def isCongestion(failure):
+    '''A failed attempt (see XIQ.lastCallFailures) that means the tenant is overloaded: 408/429/5xx or a connection error.'''
+    return failure is None or (isinstance(failure, int) and isRetryableStatus(failure))
+
+
+class AdaptiveConcurrency:
+    '''
+    AIMD limit on the number of calls in flight, in the spirit of TCP congestion control:
+    - every call that succeeds first time at a normal latency adds 1/limit (so +1 per limit's worth of calls)
+    - a call that hit a 429, 5xx or connection error halves the limit
+    - a call slower than latency_factor x the baseline latency (the lowest smoothed latency seen) cuts it by 10%
+    Only one decrease is applied per window: calls that started before the last decrease don't decrease again,
+    so one burst of 429s costs a single halving. The limit stays between minimum and maximum; every change
+    of the whole number of slots is logged.
+    '''
+    def __init__(self, initial=4, minimum=1, maximum=64, latency_factor=2.0, name="regenerate-password"):
+        self.minimum = max(int(minimum), 1)
+        self.maximum = max(int(maximum), self.minimum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_factor = latency_factor
+        self.name = name
+        self.in_flight = 0
+        self.changes = 0
+        self.__latency = None
+        self.__baseline = None
+        self.__samples = 0
+        self.__started = 0
+        self.__last_decrease = 0
+        self.__condition = threading.Condition()
+
+    def slots(self):
+        return int(self.limit)
+
+    def acquire(self):
+        '''Block until a call may start. Returns a ticket to pass to release().'''
+        with self.__condition:
+            while self.in_flight >= self.slots():
+                self.__condition.wait()
+            self.in_flight += 1
+            self.__started += 1
+            return self.__started
+
+    def release(self, ticket, latency, failures=()):
+        '''Report a finished call: its duration in seconds and its failed attempts (XIQ.lastCallFailures).'''
+        with self.__condition:
+            self.in_flight -= 1
+            before = self.slots()
+            reason = None
+            congested = [failure for failure in failures if isCongestion(failure)]
+            if congested:
+                reason = f"HTTP {congested[-1]}" if congested[-1] is not None else "connection error"
+                self.__decrease(ticket, 0.5)
+            elif not failures:
+                self.__sample(latency)
+                if self.__samples >= 10 and self.__latency > self.__baseline * self.latency_factor:
+                    reason = f"latency {self.__latency * 1000:.0f}ms vs {self.__baseline * 1000:.0f}ms baseline"
+                    self.__decrease(ticket, 0.9)
+                else:
+                    self.limit = min(self.limit + 1 / self.limit, self.maximum)
+            after = self.slots()
+            if after != before:
+                self.changes += 1
+                if after > before:
+                    logging.info(f"Adaptive concurrency for {self.name}: {before} -> {after}")
+                else:
+                    logging.info(f"Adaptive concurrency for {self.name}: {before} -> {after} ({reason})")
+            self.__condition.notify_all()
+
+    def __sample(self, latency):
+        # exponentially weighted latency, the lowest value it reaches is the uncongested baseline
+        self.__latency = latency if self.__latency is None else 0.8 * self.__latency + 0.2 * latency
+        self.__samples += 1
+        if self.__samples >= 5 and (self.__baseline is None or self.__latency < self.__baseline):
+            self.__baseline = self.__latency
+
+    def __decrease(self, ticket, factor):
+        if ticket <= self.__last_decrease:
+            return
+        self.limit = max(self.limit * factor, self.minimum)
+        self.__last_decrease = self.__started
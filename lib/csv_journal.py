@@ -0,0 +1,60 @@
+import csv
+import os
+import time
+
+
+class CsvJournal:
+    '''
+    csv writer that pushes rows to disk as they are produced instead of at the end of a run.
+    Rows are flushed and fsync'd every `flush_every` rows or `flush_interval` seconds, whichever
+    comes first, so at most that many rows are ever buffered and a crash only loses unflushed rows.
+
+    with CsvJournal("user_password_list.csv", ["xiq_id", "user_name"]) as journal:
+        journal.writerow({"xiq_id": 1, "user_name": "guest"})
+    '''
+    def __init__(self, path, field_names, flush_every=25, flush_interval=2.0, append=False):
+        self.path = path
+        self.flush_every = max(int(flush_every), 1)
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self.__unflushed = 0
+        self.__last_flush = time.monotonic()
+        self.__flush_listeners = []
+        write_header = not (append and os.path.exists(path) and os.path.getsize(path) > 0)
+        self.__file = open(path, mode="a" if append else "w", newline="")
+        self.__writer = csv.DictWriter(self.__file, fieldnames=field_names, extrasaction="ignore")
+        if write_header:
+            self.__writer.writeheader()
+            self.flush()
+
+    def addFlushListener(self, listener):
+        # listener() is called every time rows have been made durable (ex. Checkpoint.commit)
+        self.__flush_listeners.append(listener)
+
+    def writerow(self, row):
+        self.__writer.writerow(row)
+        self.rows_written += 1
+        self.__unflushed += 1
+        if self.__unflushed >= self.flush_every or time.monotonic() - self.__last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.__unflushed = 0
+        self.__last_flush = time.monotonic()
+        for listener in self.__flush_listeners:
+            listener()
+
+    def close(self):
+        if not self.__file.closed:
+            self.flush()
+            self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # always persist what we have, especially when the run is dying
+        self.close()
+        return False
@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from lib.atomic_file import atomicWrite
+
+DEFAULT_CATALOG_FILE = os.path.join(os.path.expanduser("~"), ".xiq", "group_catalog.json")
+GROUP_FIELDS = ("id", "name", "description", "password_db_location")
+# several catalogs (one per external account) may update the same cache file
+_cache_file_lock = threading.Lock()
+
+
+def addCatalogArguments(parser):
+    parser.add_argument('--group-cache', dest='group_cache', default=DEFAULT_CATALOG_FILE, help=f'file caching the user group list between runs (default {DEFAULT_CATALOG_FILE})')
+    parser.add_argument('--group-cache-ttl', dest='group_cache_ttl', type=int, default=3600, help='seconds a cached user group list is reused (default 3600, 0 disables the cache)')
+    parser.add_argument('--refresh-groups', dest='refresh_groups', action="store_true", help='Optional - ignore the cached user group list and download it again')
+
+
+def catalogFromArgs(x, args):
+    return GroupCatalog(x, cache_file=args.group_cache, ttl=args.group_cache_ttl, refresh=args.refresh_groups)
+
+
+class GroupCatalog:
+    '''
+    Indexed list of the user groups of one VIQ, cached on disk so runs don't download /usergroups every time.
+    All groups are fetched once (CLOUD and LOCAL) and filtered locally, so every menu and lookup is served
+    from the same listing. Lookups by name, id and password_db_location are dictionary lookups.
+    The cache file holds one entry per VIQ and is only readable by the current user.
+    '''
+    def __init__(self, x, cache_file=DEFAULT_CATALOG_FILE, ttl=3600, refresh=False, limit=100):
+        # ttl - seconds a cached listing is reused, 0 always downloads (and never writes the cache)
+        self.x = x
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.limit = limit
+        self.fetched_at = None
+        self.__force_refresh = refresh
+        self.__downloaded = False
+        self.__groups = None
+        self.__by_name = {}
+        self.__by_id = {}
+        self.__by_location = {}
+        self.__lock = threading.RLock()
+
+    def __tenantKey(self):
+        # None when the VIQ is unknown (ex. /account/home failed): the cache is then neither read nor written,
+        # an unknown tenant must never be served another tenant's groups
+        viq_id = self.x.getViqID()
+        if viq_id is None:
+            return None
+        return f"{self.x.URL}|{viq_id}"
+
+    def __readCache(self):
+        try:
+            with open(self.cache_file) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def __writeCache(self, groups):
+        tenant_key = self.__tenantKey()
+        if tenant_key is None:
+            return
+        with _cache_file_lock:
+            entries = self.__readCache()
+            entries[tenant_key] = {"fetched_at": self.fetched_at, "groups": groups}
+            atomicWrite(self.cache_file, json.dumps(entries), mode=0o600)
+
+    def __index(self, groups, fetched_at):
+        self.__groups = groups
+        self.fetched_at = fetched_at
+        self.__by_name = {group["name"]: group for group in groups}
+        self.__by_id = {str(group["id"]): group for group in groups}
+        self.__by_location = {}
+        for group in groups:
+            self.__by_location.setdefault(str(group.get("password_db_location")).upper(), []).append(group)
+
+    def __load(self):
+        with self.__lock:
+            if self.__groups is not None:
+                return
+            tenant_key = self.__tenantKey()
+            if self.ttl and not self.__force_refresh and tenant_key is not None:
+                entry = self.__readCache().get(tenant_key)
+                if entry and entry.get("fetched_at", 0) + self.ttl > time.time():
+                    logging.info(f"Using cached list of {len(entry['groups'])} user groups")
+                    self.__index(entry["groups"], entry["fetched_at"])
+                    return
+            self.refresh()
+
+    def isCached(self):
+        # True when the current listing came from the cache file rather than a download in this run
+        return self.__groups is not None and not self.__downloaded
+
+    def refresh(self):
+        '''Download every user group again and update the cache.'''
+        with self.__lock:
+            logging.info("Retrieving all User Groups from XIQ")
+            groups = [{field: data_record.get(field) for field in GROUP_FIELDS}
+                      for data_record in self.x.iterUserGroups(limit=self.limit)]
+            self.__index(groups, time.time())
+            self.__force_refresh = False
+            self.__downloaded = True
+            if self.ttl:
+                self.__writeCache(groups)
+        return groups
+
+    def groups(self, type=None):
+        '''All groups, or only the CLOUD / LOCAL ones, in XIQ listing order.'''
+        self.__load()
+        if type is None:
+            return list(self.__groups)
+        return list(self.__by_location.get(str.upper(type), []))
+
+    def byName(self, name):
+        self.__load()
+        return self.__by_name.get(name)
+
+    def byId(self, group_id):
+        self.__load()
+        return self.__by_id.get(str(group_id))
+
+    def byLocation(self, password_db_location):
+        return self.groups(type=password_db_location)
@@ -2,13 +2,15 @@ import logging
 import os
 import sys
 import time
-import colorlog
 
 class CustomLogger:
     def __init__(self, log_folder='log'):
         self.log_folder = log_folder
 
     def create_logger(self):
+        # colorlog is only needed once logging is actually set up, keep it off the import path
+        import colorlog
+
         # Ensure the log folder exists
         if not os.path.exists(self.log_folder):
             os.makedirs(self.log_folder)
@@ -0,0 +1,176 @@
+import json
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+from lib.atomic_file import atomicWrite
+
+# latency histogram bucket upper bounds in seconds (Prometheus style, +Inf is implied)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0)
+
+
+def endpointName(method, url):
+    '''"POST", "https://.../endusers/1234/:regenerate-password?x=1" -> "POST /endusers/{id}/:regenerate-password"'''
+    path = re.sub(r"/\d+(?=/|$)", "/{id}", urlparse(url).path)
+    return f"{method} {path}"
+
+
+def histogramPercentile(buckets, q):
+    '''Estimate the q-th percentile (0-1) from LATENCY_BUCKETS counts, interpolating linearly inside the bucket.'''
+    total = sum(buckets)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    lower = 0.0
+    for index, count in enumerate(buckets):
+        upper = LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else LATENCY_BUCKETS[-1]
+        if count and seen + count >= rank:
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+        lower = upper
+    return LATENCY_BUCKETS[-1]
+
+
+class EndpointStats:
+    __slots__ = ("calls", "retries", "bytes_sent", "bytes_received", "latency_sum", "buckets", "codes")
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.codes = {}
+
+    def percentile(self, q):
+        return histogramPercentile(self.buckets, q)
+
+
+class ApiMetrics:
+    '''
+    Thread-safe per-endpoint instrumentation of the XIQ request layer: call counts, latency histogram
+    (p50/p95/p99), bytes sent/received, retries and response codes (HTTP status or exception name).
+    Read it with snapshot(), or dump it with writeJson() / writePrometheus() at the end of a run.
+    '''
+    def __init__(self):
+        self.started = time.time()
+        self.__endpoints = {}
+        self.__lock = threading.Lock()
+
+    def __stats(self, endpoint):
+        stats = self.__endpoints.get(endpoint)
+        if stats is None:
+            stats = self.__endpoints[endpoint] = EndpointStats()
+        return stats
+
+    def record(self, endpoint, code, elapsed, bytes_sent=0, bytes_received=0):
+        bucket = len(LATENCY_BUCKETS)
+        for index, upper in enumerate(LATENCY_BUCKETS):
+            if elapsed <= upper:
+                bucket = index
+                break
+        with self.__lock:
+            stats = self.__stats(endpoint)
+            stats.calls += 1
+            stats.latency_sum += elapsed
+            stats.buckets[bucket] += 1
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.codes[str(code)] = stats.codes.get(str(code), 0) + 1
+
+    def recordRetry(self, endpoint):
+        with self.__lock:
+            self.__stats(endpoint).retries += 1
+
+    def totals(self):
+        with self.__lock:
+            return {
+                "calls": sum(stats.calls for stats in self.__endpoints.values()),
+                "retries": sum(stats.retries for stats in self.__endpoints.values()),
+            }
+
+    def histogram(self):
+        '''(calls, retries, latency bucket counts) summed over every endpoint, cheap enough to poll.'''
+        with self.__lock:
+            buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+            calls = retries = 0
+            for stats in self.__endpoints.values():
+                calls += stats.calls
+                retries += stats.retries
+                for index, count in enumerate(stats.buckets):
+                    buckets[index] += count
+            return calls, retries, buckets
+
+    def snapshot(self):
+        with self.__lock:
+            endpoints = {}
+            for endpoint, stats in sorted(self.__endpoints.items()):
+                endpoints[endpoint] = {
+                    "calls": stats.calls,
+                    "retries": stats.retries,
+                    "bytes_sent": stats.bytes_sent,
+                    "bytes_received": stats.bytes_received,
+                    "latency_avg": stats.latency_sum / stats.calls if stats.calls else None,
+                    "latency_p50": stats.percentile(0.50),
+                    "latency_p95": stats.percentile(0.95),
+                    "latency_p99": stats.percentile(0.99),
+                    "codes": dict(stats.codes),
+                }
+        return {"started": self.started, "duration": time.time() - self.started, "endpoints": endpoints}
+
+    def writeJson(self, path, extra=None):
+        data = self.snapshot()
+        if extra:
+            data.update(extra)
+        atomicWrite(path, json.dumps(data, indent=2))
+
+    def prometheusText(self, prefix="xiq_api"):
+        lines = []
+
+        def header(name, kind, description):
+            lines.append(f"# HELP {prefix}_{name} {description}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        with self.__lock:
+            endpoints = sorted(self.__endpoints.items())
+            labelled = [(f'method="{endpoint.split(" ", 1)[0]}",endpoint="{endpoint.split(" ", 1)[1]}"', stats)
+                        for endpoint, stats in endpoints]
+
+            header("requests_total", "counter", "XIQ API responses by endpoint and status code")
+            for labels, stats in labelled:
+                for code, count in sorted(stats.codes.items()):
+                    lines.append(f'{prefix}_requests_total{{{labels},code="{code}"}} {count}')
+            header("retries_total", "counter", "XIQ API calls retried")
+            for labels, stats in labelled:
+                lines.append(f"{prefix}_retries_total{{{labels}}} {stats.retries}")
+            header("request_bytes_total", "counter", "bytes sent to the XIQ API")
+            for labels, stats in labelled:
+                lines.append(f"{prefix}_request_bytes_total{{{labels}}} {stats.bytes_sent}")
+            header("response_bytes_total", "counter", "bytes received from the XIQ API")
+            for labels, stats in labelled:
+                lines.append(f"{prefix}_response_bytes_total{{{labels}}} {stats.bytes_received}")
+            header("request_duration_seconds", "histogram", "XIQ API request latency")
+            for labels, stats in labelled:
+                cumulative = 0
+                for index, upper in enumerate(LATENCY_BUCKETS):
+                    cumulative += stats.buckets[index]
+                    lines.append(f'{prefix}_request_duration_seconds_bucket{{{labels},le="{upper}"}} {cumulative}')
+                lines.append(f'{prefix}_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.calls}')
+                lines.append(f"{prefix}_request_duration_seconds_sum{{{labels}}} {stats.latency_sum:.6f}")
+                lines.append(f"{prefix}_request_duration_seconds_count{{{labels}}} {stats.calls}")
+        header("last_run_timestamp_seconds", "gauge", "time the metrics were written")
+        lines.append(f"{prefix}_last_run_timestamp_seconds {time.time():.0f}")
+        return "\n".join(lines) + "\n"
+
+    def writePrometheus(self, path):
+        atomicWrite(path, self.prometheusText())
+
+    def logSummary(self, logger):
+        for endpoint, stats in self.snapshot()["endpoints"].items():
+            p50 = stats["latency_p50"] or 0
+            p95 = stats["latency_p95"] or 0
+            logger.info(f"{endpoint}: {stats['calls']} calls, {stats['retries']} retries, "
+                        f"p50 {p50 * 1000:.0f}ms, p95 {p95 * 1000:.0f}ms, codes {stats['codes']}")
@@ -0,0 +1,83 @@
+import json
+import logging
+import math
+import time
+
+from lib.policy import parseDuration
+from lib.planner import formatDuration
+from lib.atomic_file import atomicWrite
+
+
+def addPacingArguments(parser):
+    parser.add_argument('--spread', default=None, help='Optional - spread the password regenerations evenly over this long (ex. 4h) to bound the API and notification rate')
+    parser.add_argument('--spread-batch', dest='spread_batch', type=int, default=1, help='users regenerated together at each step of --spread (default 1)')
+
+
+def spreadFromArgs(args):
+    '''--spread as seconds, None when not given. Raises ValueError for an invalid duration.'''
+    return parseDuration(args.spread) if args.spread else None
+
+
+class Pacer:
+    '''
+    Timetable of items spread evenly over a window: batch k of `batch` items is due at start + k * interval
+    on the monotonic clock. Deadlines are absolute, so time spent in the caller (slow API calls, retries)
+    never pushes the rest of the schedule back - a late run catches up instead of drifting past the end of
+    the window. The Pacer never sleeps itself: the caller waits out remaining(index) however suits it
+    (RotationEngine.rotate journals the calls completing in the meantime).
+    '''
+    def __init__(self, total, window, batch=1, clock=time.monotonic):
+        self.total = total
+        self.window = max(window, 0)
+        self.batch = max(int(batch), 1)
+        self.interval = self.window / max(math.ceil(total / self.batch), 1)
+        self.clock = clock
+        self.start = clock()
+
+    def deadline(self, index):
+        return self.start + (index // self.batch) * self.interval
+
+    def remaining(self, index):
+        # seconds until item index is due, 0 once it is
+        return max(self.deadline(index) - self.clock(), 0)
+
+    def describe(self):
+        per_hour = self.batch * 3600 / self.interval if self.interval else float("inf")
+        return (f"{self.total} regenerations over {formatDuration(self.window)}, {self.batch} every "
+                f"{self.interval:.2f}s (~{per_hour:.0f}/h)")
+
+
+class PaceState:
+    '''
+    End of a paced rotation's window, stored next to its checkpoint ({"group_id": ..., "deadline": epoch}),
+    so a resumed run spreads the remaining users over what is left of the original window.
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    def deadline(self, group_id):
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if str(data.get("group_id")) != str(group_id):
+            return None
+        return data.get("deadline")
+
+    def save(self, group_id, deadline):
+        atomicWrite(self.path, json.dumps({"group_id": group_id, "deadline": deadline}))
+
+
+def pacedWindow(pace_state, group_id, spread, resume=False):
+    '''Seconds the rotation has left: the remaining part of a resumed window, or a new window of spread seconds.'''
+    now = time.time()
+    deadline = pace_state.deadline(group_id) if resume else None
+    if deadline is None:
+        pace_state.save(group_id, now + spread)
+        return spread
+    if deadline <= now:
+        logging.warning("The paced window of the interrupted run has already ended, rotating the remaining users without pacing")
+        return 0
+    logging.info(f"Resuming the paced window, {formatDuration(deadline - now)} left")
+    return deadline - now
@@ -0,0 +1,109 @@
+import logging
+import math
+import time
+
+from lib.metrics import endpointName
+
+LIST_ENDPOINT = endpointName("GET", "/endusers")
+REGENERATE_ENDPOINT = endpointName("POST", "/endusers/0/:regenerate-password")
+
+
+def formatDuration(seconds):
+    '''3725 -> "1h 02m 05s"'''
+    seconds = int(math.ceil(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m {seconds:02d}s"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
+
+
+def measuredLatency(x):
+    '''
+    Average seconds per call from this run's metrics: the regenerate-password endpoint when it has already
+    been called, otherwise the user listing. Returns (latency, endpoint measured).
+    '''
+    endpoints = x.metrics.snapshot()["endpoints"]
+    for endpoint in (REGENERATE_ENDPOINT, LIST_ENDPOINT):
+        if endpoints.get(endpoint, {}).get("latency_avg"):
+            return endpoints[endpoint]["latency_avg"], endpoint
+    return None, None
+
+
+def planGroup(x, group_id, workers=1, policy=None, completed=None, limit=100, spread=None):
+    '''
+    Dry run of rotateGroup: list the group (pages fetched in parallel, like the rotation does) and count
+    the users that would get a regenerate-password call, without regenerating anything.
+    completed - ids already rotated by an interrupted run (see checkpoint.readCheckpoint), skipped like --resume.
+    spread - seconds a paced rotation is spread over (--spread), the run takes at least that long.
+    Returns a dict with the user counts, the exact number of API calls the rotation would make and
+    the estimated wall time in seconds (see estimateSeconds).
+    '''
+    completed = completed or set()
+    plan = {"users": 0, "due": 0, "skipped": 0, "not_due": 0}
+    start = time.perf_counter()
+    for data_record in x.iterUsersByGroupID(group_id, limit=limit):
+        plan["users"] += 1
+        if str(data_record.get("id")) in completed:
+            plan["skipped"] += 1
+        elif policy is not None and not policy.isDue(data_record):
+            plan["not_due"] += 1
+        else:
+            plan["due"] += 1
+    listing_seconds = time.perf_counter() - start
+
+    # the rotation lists the group once more and makes one regenerate-password call per due user
+    plan["list_calls"] = max(math.ceil(plan["users"] / limit), 1)
+    plan["api_calls"] = plan["list_calls"] + plan["due"]
+    latency, measured_on = measuredLatency(x)
+    rate = x.rate_limiter.rate if x.rate_limiter is not None else None
+    plan["latency"] = latency
+    plan["estimate"] = estimateSeconds(plan["due"], plan["api_calls"], latency, workers, listing_seconds, rate)
+    if spread and plan["due"]:
+        plan["estimate"] = max(plan["estimate"], spread)
+    logging.info(f"Planned group {group_id}: {plan['users']} users listed in {formatDuration(listing_seconds)}, "
+                 f"{plan['due']} would be rotated (latency {latency * 1000 if latency else 0:.0f}ms "
+                 f"measured on {measured_on})")
+    return plan
+
+
+def estimateSeconds(due, api_calls, latency, workers=1, listing_seconds=0.0, rate=None):
+    '''
+    Rotation wall time: the listing streams into the workers, so the slowest of the listing itself,
+    the regenerate calls spread over the workers and the client-side rate limit bounds the run.
+    Retries (429/5xx) are not included.
+    '''
+    regenerate_seconds = math.ceil(due / max(workers, 1)) * (latency or 0)
+    estimate = max(listing_seconds, regenerate_seconds + (latency or 0))
+    if rate:
+        estimate = max(estimate, api_calls / rate)
+    return estimate
+
+
+def logPlan(name, plan, workers=1, rate=None):
+    logging.info(f"************ Rotation plan: {name} ************")
+    logging.info(f"Users listed: {plan['users']}")
+    if plan["skipped"]:
+        logging.info(f"Already rotated (checkpoint): {plan['skipped']}")
+    if plan["not_due"]:
+        logging.info(f"Not due (policy): {plan['not_due']}")
+    logging.info(f"Passwords that would be regenerated: {plan['due']}")
+    logging.info(f"API calls: {plan['api_calls']} ({plan['list_calls']} listing pages + "
+                 f"{plan['due']} regenerate-password calls, plus retries)")
+    limits = f"{workers} workers" + (f", {rate:g} requests/s rate limit" if rate else "")
+    logging.info(f"Estimated wall time: {formatDuration(plan['estimate'])} ({limits})")
+
+
+def combinePlans(plans, group_workers=1, rate=None):
+    '''
+    Totals of several group plans run group_workers at a time with one (shared) rate limit.
+    Returns a dict like planGroup's, with the batch wall time estimate.
+    '''
+    total = {key: sum(plan[key] for plan in plans) for key in ("users", "due", "skipped", "not_due", "list_calls", "api_calls")}
+    estimates = [plan["estimate"] for plan in plans]
+    total["estimate"] = max(max(estimates, default=0), sum(estimates) / max(group_workers, 1))
+    if rate:
+        total["estimate"] = max(total["estimate"], total["api_calls"] / rate)
+    return total
@@ -0,0 +1,78 @@
+import fnmatch
+import re
+import time
+from datetime import datetime, timezone
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+def parseDuration(value):
+    '''"90d" / "12h" / "30m" / "45s" / "2w" / "3600" -> seconds'''
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*", str(value).lower())
+    if not match:
+        raise ValueError(f"Invalid duration '{value}', use a number followed by s, m, h, d or w (ex. 90d)")
+    return float(match.group(1)) * DURATION_UNITS[match.group(2) or "s"]
+
+
+def parseTimestamp(value):
+    '''XIQ timestamp (ISO 8601 string or epoch milliseconds/seconds) -> epoch seconds, None if unknown'''
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)) or str(value).isdigit():
+        value = float(value)
+        return value / 1000 if value > 1e11 else value
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def addPolicyArguments(parser):
+    parser.add_argument('--min-age', dest='min_age', default=None, help='Optional - only rotate users whose record was last changed at least this long ago (ex. 90d, 12h)')
+    parser.add_argument('--user-filter', dest='user_filters', action="append", default=[], metavar='FIELD=PATTERN', help='Optional - only rotate users whose /endusers FIELD matches PATTERN (shell wildcards), can be repeated')
+
+
+def policyFromArgs(args):
+    if not args.min_age and not args.user_filters:
+        return None
+    filters = {}
+    for user_filter in args.user_filters:
+        field, separator, pattern = user_filter.partition("=")
+        if not separator or not field:
+            raise ValueError(f"Invalid --user-filter '{user_filter}', expected FIELD=PATTERN")
+        filters[field.strip()] = pattern
+    return RotationPolicy(min_age=parseDuration(args.min_age) if args.min_age else None, filters=filters)
+
+
+class RotationPolicy:
+    '''
+    Decides from the /endusers data alone which users are due for rotation, so users that are not due
+    never cost a regenerate-password call (or a notification).
+    min_age - seconds; a user is due when its update_time (or create_time) is at least this old.
+              Users without a usable timestamp are treated as due.
+    filters - {field: pattern}; every field of the user must match its shell-style pattern.
+    '''
+    def __init__(self, min_age=None, filters=None):
+        self.min_age = min_age
+        self.filters = filters or {}
+
+    def isDue(self, data_record):
+        for field, pattern in self.filters.items():
+            if not fnmatch.fnmatchcase(str(data_record.get(field, "")), pattern):
+                return False
+        if self.min_age is not None:
+            changed = parseTimestamp(data_record.get("update_time")) or parseTimestamp(data_record.get("create_time"))
+            # measured against the current time, one policy may serve a long lived schedule daemon
+            if changed is not None and time.time() - changed < self.min_age:
+                return False
+        return True
+
+    def describe(self):
+        parts = []
+        if self.min_age is not None:
+            parts.append(f"last changed at least {self.min_age / 86400:g} days ago")
+        parts.extend(f"{field} matching '{pattern}'" for field, pattern in self.filters.items())
+        return "users " + " and ".join(parts)
@@ -0,0 +1,159 @@
+import logging
+import sys
+import threading
+import time
+from collections import deque
+
+from lib.metrics import histogramPercentile
+from lib.planner import formatDuration
+
+# seconds between redraws of the progress line on a terminal
+TTY_REFRESH = 0.5
+# seconds between progress lines in the log when stdout is not a terminal (cron, daemon, redirected output)
+LOG_REFRESH = 30.0
+# request rate and p95 latency are measured over this many recent seconds
+RATE_WINDOW = 10.0
+
+
+class Progress:
+    '''
+    Live progress of a long loop (listing or rotating a group): completed/total, XIQ requests per second,
+    p95 latency, retries and ETA. The loop only bumps counters with advance(); a background thread renders
+    them at a fixed rate, as one line redrawn in place on a terminal or as a log line every LOG_REFRESH
+    seconds otherwise. Only one Progress draws on the terminal at a time, others (ex. batch groups running
+    side by side) fall back to log lines. While it draws, log records sent to the same terminal clear the line
+    first and it is redrawn below them. Request rate, latency and retries come from the client's ApiMetrics.
+    '''
+    __terminal = threading.Lock()
+
+    def __init__(self, label, metrics=None, total=None, stream=None):
+        self.label = label
+        self.metrics = metrics
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.stream = stream or sys.stdout
+        self.started = time.monotonic()
+        self.__samples = deque()
+        self.__retries_at_start = metrics.histogram()[1] if metrics is not None else 0
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__on_terminal = False
+        self.__draw_lock = threading.Lock()
+        self.__drawn = ""
+        self.__handlers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        isatty = getattr(self.stream, "isatty", None)
+        if isatty is not None and isatty() and self.__terminal.acquire(blocking=False):
+            self.__on_terminal = True
+            self.__hookHandlers()
+        self.__thread = threading.Thread(target=self.__run, name=f"progress-{self.label}", daemon=True)
+        self.__thread.start()
+        return self
+
+    def setTotal(self, total):
+        self.total = total
+
+    def addTotal(self, count):
+        # for several listings feeding one Progress (ex. every group into one file), called from their threads
+        with self.__lock:
+            self.total = (self.total or 0) + count
+
+    def skip(self, count=1):
+        # items that need no work (ex. already rotated) leave the total instead of counting as done
+        if self.total is not None:
+            self.total = max(self.total - count, 0)
+
+    def advance(self, count=1, failed=False):
+        self.done += count
+        if failed:
+            self.failed += count
+
+    def __hookHandlers(self):
+        # console handlers writing to our terminal go through __emit, so a record never lands on the live line
+        for handler in logging.getLogger().handlers:
+            if isinstance(handler, logging.StreamHandler) and getattr(handler, "stream", None) is self.stream:
+                handler.emit = self.__emitter(handler.emit)
+                self.__handlers.append(handler)
+
+    def __emitter(self, emit):
+        def emit_below(record):
+            with self.__draw_lock:
+                self.stream.write("\r\x1b[K")
+                emit(record)
+                self.stream.write(self.__drawn)
+                self.stream.flush()
+        return emit_below
+
+    def __run(self):
+        interval = TTY_REFRESH if self.__on_terminal else LOG_REFRESH
+        while not self.__stop.wait(interval):
+            self.__render()
+
+    def __sample(self):
+        # (time, done, calls, retries, latency buckets), the oldest sample inside RATE_WINDOW is the baseline
+        now = time.monotonic()
+        calls, retries, buckets = self.metrics.histogram() if self.metrics is not None else (0, 0, [])
+        self.__samples.append((now, self.done, calls, retries, buckets))
+        while len(self.__samples) > 2 and self.__samples[1][0] <= now - RATE_WINDOW:
+            self.__samples.popleft()
+        return self.__samples[0], self.__samples[-1]
+
+    def line(self):
+        first, last = self.__sample()
+        elapsed = last[0] - first[0]
+        parts = [f"{self.label}: {self.done}/{self.total if self.total is not None else '?'}"]
+        if self.total:
+            parts[0] += f" ({min(self.done / self.total, 1):.0%})"
+        if self.failed:
+            parts.append(f"{self.failed} failed")
+        if self.metrics is not None:
+            if elapsed > 0:
+                parts.append(f"{(last[2] - first[2]) / elapsed:.1f} req/s")
+            p95 = histogramPercentile([b - a for a, b in zip(first[4], last[4])], 0.95)
+            if p95 is not None:
+                parts.append(f"p95 {p95 * 1000:.0f}ms")
+            parts.append(f"retries {last[3] - self.__retries_at_start}")
+        if self.total is not None and self.done < self.total:
+            rate = (last[1] - first[1]) / elapsed if elapsed > 0 else 0
+            if not rate and self.done:
+                rate = self.done / max(last[0] - self.started, 1e-9)
+            parts.append(f"ETA {formatDuration((self.total - self.done) / rate)}" if rate else "ETA ?")
+        return " | ".join(parts)
+
+    def __render(self):
+        if self.__on_terminal:
+            line = self.line()
+            with self.__draw_lock:
+                self.__drawn = f"\r{line}\x1b[K"
+                self.stream.write(self.__drawn)
+                self.stream.flush()
+        else:
+            logging.info(self.line())
+
+    def close(self):
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        if self.__on_terminal:
+            for handler in self.__handlers:
+                del handler.emit
+            self.__handlers = []
+            # clear the live line, the summary below goes to the log like any other message
+            with self.__draw_lock:
+                self.__drawn = ""
+                self.stream.write("\r\x1b[K")
+                self.stream.flush()
+            self.__terminal.release()
+            self.__on_terminal = False
+        logging.info(f"{self.label}: {self.done} done in {formatDuration(time.monotonic() - self.started)}"
+                     + (f", {self.failed} failed" if self.failed else ""))
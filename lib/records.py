@@ -0,0 +1,52 @@
+class UserRecord:
+    '''
+    One PPSK end user as the rotation needs it. Slotted, so a record costs a fraction of the
+    dictionary XIQ returns for the same user - only the four fields written to the csv are kept.
+    '''
+    __slots__ = ("xiq_id", "user_name", "existing_pw", "new_pw")
+
+    def __init__(self, xiq_id, user_name=None, existing_pw=None, new_pw=None):
+        self.xiq_id = xiq_id
+        self.user_name = user_name
+        self.existing_pw = existing_pw
+        self.new_pw = new_pw
+
+    @classmethod
+    def fromApi(cls, data_record):
+        '''Build a record from an /endusers data entry'''
+        return cls(data_record.get("id"), data_record.get("user_name"), data_record.get("password"))
+
+    def asRow(self):
+        return {"xiq_id": self.xiq_id, "user_name": self.user_name, "existing_pw": self.existing_pw, "new_pw": self.new_pw}
+
+    def __repr__(self):
+        return f"UserRecord(xiq_id={self.xiq_id!r}, user_name={self.user_name!r})"
+
+
+class UserRecords:
+    '''Insertion-ordered container of UserRecord keyed on XIQ end-user id.'''
+    __slots__ = ("__records",)
+
+    def __init__(self, records=()):
+        self.__records = {}
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        self.__records[record.xiq_id] = record
+        return record
+
+    def get(self, xiq_id):
+        return self.__records.get(xiq_id)
+
+    def ids(self):
+        return self.__records.keys()
+
+    def __contains__(self, xiq_id):
+        return xiq_id in self.__records
+
+    def __len__(self):
+        return len(self.__records)
+
+    def __iter__(self):
+        return iter(self.__records.values())
@@ -0,0 +1,82 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# 408 Request Timeout, 429 Too Many Requests and any 5xx are worth another attempt
+RETRYABLE_STATUS_CODES = {408, 429}
+
+
+def isRetryableStatus(status_code):
+    return status_code in RETRYABLE_STATUS_CODES or 500 <= status_code <= 599
+
+
+def parseRetryAfter(value):
+    '''Retry-After header -> seconds to wait (None if missing or unparsable). Accepts seconds or an HTTP date.'''
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+class RetryableError(ValueError):
+    '''
+    Raised by the XIQ request layer for failures that should be retried (429, 5xx, connection errors).
+    Subclasses ValueError so existing "except ValueError" retry branches keep treating it as retryable.
+    '''
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class RetryPolicy:
+    '''
+    Exponential backoff with full jitter: attempt n waits a random time in [0, min(max_delay, base_delay * 2**(n-1))].
+    A Retry-After from the server is honoured as the minimum wait.
+    '''
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=30.0):
+        self.max_attempts = max(int(max_attempts), 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, retry_after=None):
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+        if retry_after is not None:
+            return max(min(retry_after, self.max_delay * 4), backoff)
+        return backoff
+
+    def wait(self, attempt, retry_after=None):
+        time.sleep(self.delay(attempt, retry_after))
+
+
+class TokenBucket:
+    '''
+    Thread-safe client-side rate limiter. Holds up to `capacity` tokens refilled at `rate` tokens per second;
+    acquire() blocks until a token is available. One bucket can be shared by several XIQ clients.
+    '''
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.__tokens = self.capacity
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.rate)
+                self.__updated = now
+                if self.__tokens >= tokens:
+                    self.__tokens -= tokens
+                    return
+                wait = (tokens - self.__tokens) / self.rate
+            time.sleep(wait)
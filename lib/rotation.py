@@ -0,0 +1,383 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from lib.csv_journal import CsvJournal
+from lib.checkpoint import Checkpoint, checkNoEarlierRun
+from lib.records import UserRecord, UserRecords
+from lib.pacing import Pacer, PaceState, pacedWindow
+from lib.concurrency import AdaptiveConcurrency
+from lib.progress import Progress
+from lib.retry import RetryPolicy
+from lib.xiq_api import XIQError
+from lib.verify import verifyGroup
+from lib.atomic_file import atomicWrite
+
+EXPORT_FIELDS = ["xiq_id", "user_name", "existing_pw"]
+ROTATE_FIELDS = ["xiq_id", "user_name", "existing_pw", "new_pw"]
+SNAPSHOT_FIELDS = ["group_id", "group_name", "xiq_id", "user_name", "existing_pw"]
+# an export changes nothing in XIQ, its rows only need to reach the disk in large batches
+EXPORT_FLUSH_EVERY = 1000
+# users whose calls ran out of retries are tried again after the main pass, with this separate, slower budget
+DEFERRED_RETRY = RetryPolicy(max_attempts=3, base_delay=10, max_delay=120)
+
+
+def iterUserRecords(x, group_id, limit=100, on_total=None):
+    '''
+    Stream the users of a group as compact UserRecords, parsed straight from each page
+    so the raw page data can be dropped as soon as the page is consumed.
+    '''
+    for data_record in x.iterUsersByGroupID(group_id, limit=limit, on_total=on_total):
+        yield UserRecord.fromApi(data_record)
+
+
+class RotationEngine:
+    def __init__(self, x, workers=1, max_workers=None, stop=None):
+        # x - authenticated XIQ client, shared by all worker threads
+        # workers - number of regenerate-password calls allowed in flight at once
+        # max_workers - let an AdaptiveConcurrency controller move the number of calls in flight
+        #               between 1 and max_workers, starting from workers
+        # stop - threading.Event, once set no more users are submitted (ex. Ctrl-C in a batch run)
+        self.x = x
+        self.workers = max(int(workers), 1)
+        self.stop = stop
+        self.controller = None
+        if max_workers:
+            self.controller = AdaptiveConcurrency(initial=self.workers, maximum=max(int(max_workers), self.workers))
+
+    def regenerate(self, xiq_user_id, user_name=None):
+        # raises XIQError when the call fails for good, so the caller can carry on with the other users
+        response = self.x.postAPICall(f"/endusers/{xiq_user_id}/:regenerate-password",
+                                      info=f"regenerate password for user {user_name}", raise_errors=True)
+        password = response.get("password") if isinstance(response, dict) else None
+        if not password:
+            # ex. a 202 without a body: the password may or may not have changed, never journal it as done
+            raise XIQError(f"XIQ did not return a new password for user {user_name}")
+        return password
+
+    def __attempt(self, user):
+        try:
+            return self.regenerate(user.xiq_id, user.user_name), None
+        except XIQError as e:
+            return None, e
+        except (Exception, SystemExit) as e:
+            # anything unexpected fails this user only, it is not retried
+            logging.error(f"Unexpected error regenerating the password of user {user.user_name}: {e!r}")
+            return None, XIQError(f"Unexpected error: {e!r}")
+
+    def __adaptiveAttempt(self, ticket, user):
+        start = time.perf_counter()
+        try:
+            return self.__attempt(user)
+        finally:
+            self.controller.release(ticket, time.perf_counter() - start, self.x.lastCallFailures())
+
+    def __submit(self, executor, user):
+        if self.controller is None:
+            return executor.submit(self.__attempt, user)
+        ticket = self.controller.acquire()
+        return executor.submit(self.__adaptiveAttempt, ticket, user)
+
+    def __deadlineReached(self):
+        if self.x.deadlineReached():
+            logging.warning("Run deadline reached, no more users are rotated - run again with --resume to finish")
+            return True
+        if self.stop is not None and self.stop.is_set():
+            logging.warning("Run stopped, no more users are rotated - run again with --resume to finish")
+            return True
+        return False
+
+    def __pause(self, seconds):
+        # a pause that ends early when the run is stopped
+        if self.stop is not None:
+            self.stop.wait(seconds)
+        else:
+            time.sleep(seconds)
+
+    def __paced(self, pacer, index, pending, next_result):
+        '''
+        Wait until user index is due on the pacer's timetable, yielding every call of pending that completes in
+        the meantime so it is journaled right away rather than when the next user is released.
+        '''
+        while not (self.stop is not None and self.stop.is_set()):
+            remaining = pacer.remaining(index)
+            if self.x.deadline is not None:
+                remaining = min(remaining, max(self.x.timeLeft(), 0))
+            if remaining <= 0:
+                return
+            if not pending:
+                self.__pause(remaining)
+                continue
+            wait([pending[0][1]], timeout=remaining)
+            while pending and pending[0][1].done():
+                yield next_result()
+
+    def rotate(self, users, pacer=None):
+        '''
+        Regenerate the password of every user in the iterable users (UserRecords).
+        Yields (user, new_pw, error) in the same order users were consumed; error is the XIQError of a user
+        whose call failed (new_pw is then None), failed users never stop the others. Only a bounded number of
+        users are held in flight, so users may be a stream (ex. iterUserRecords).
+        With a Pacer (lib/pacing.py) each user is only submitted once it is due; while waiting for it the
+        results of the calls in flight are yielded as they complete.
+        '''
+        if self.workers == 1 and self.controller is None:
+            for index, user in enumerate(users):
+                if pacer is not None:
+                    yield from self.__paced(pacer, index, (), None)
+                if self.__deadlineReached():
+                    break
+                yield (user,) + self.__attempt(user)
+            return
+        max_workers = self.workers if self.controller is None else self.controller.maximum
+
+        def next_result():
+            # the user only leaves pending once its result is in hand, so an interrupted wait loses nothing
+            done_user, future = pending[0]
+            result = future.result()
+            pending.popleft()
+            return (done_user,) + result
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            try:
+                for index, user in enumerate(users):
+                    if pacer is not None:
+                        yield from self.__paced(pacer, index, pending, next_result)
+                    if self.__deadlineReached():
+                        break
+                    # hand finished results back before waiting on the next user (a streamed listing may block here)
+                    while pending and pending[0][1].done():
+                        yield next_result()
+                    pending.append((user, self.__submit(executor, user)))
+                    if len(pending) >= max_workers * 2:
+                        yield next_result()
+                while pending:
+                    yield next_result()
+            except GeneratorExit:
+                # the consumer stopped: users queued behind the running calls must never be regenerated
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            except BaseException:
+                # ex. Ctrl-C: drop the queued users and still hand back the calls that were running, so
+                # the caller journals every password that was changed before the error is raised again
+                executor.shutdown(wait=False, cancel_futures=True)
+                for done_user, future in pending:
+                    if future.cancelled() or future.exception() is not None:
+                        continue
+                    yield (done_user,) + future.result()
+                raise
+        if self.controller is not None:
+            logging.info(f"Adaptive concurrency ended at {self.controller.slots()} calls in flight "
+                         f"after {self.controller.changes} changes")
+
+
+def exportGroup(x, group_id, csv_file, limit=100, stop=None):
+    '''
+    Save the current usernames/passwords of a group to csv_file, streaming rows to disk as the pages arrive.
+    The export ends early once the threading.Event stop is set.
+    Returns the number of users written.
+    '''
+    logging.info(f"Writing to csv file - {csv_file}")
+    with Progress(f"Exporting group {group_id}", metrics=x.metrics) as progress:
+        with CsvJournal(csv_file, EXPORT_FIELDS, flush_every=EXPORT_FLUSH_EVERY) as writer:
+            for user_record in iterUserRecords(x, group_id, limit=limit, on_total=progress.setTotal):
+                if stop is not None and stop.is_set():
+                    logging.warning(f"Export of group {group_id} stopped after {writer.rows_written} users")
+                    break
+                writer.writerow(user_record.asRow())
+                progress.advance()
+    return writer.rows_written
+
+
+def exportGroups(x, groups, csv_file, group_workers=4, limit=100, stop=None):
+    '''
+    Snapshot several groups into a single csv_file (SNAPSHOT_FIELDS, a row per user tagged with its group).
+    group_workers groups are listed at the same time, each with the concurrent page fetcher; their rows are
+    handed to this thread through a bounded queue and written as they arrive, so groups are interleaved in
+    the file and memory stays flat whatever the number of users. A group that fails does not stop the others,
+    setting the threading.Event stop ends every listing early.
+    Returns {group id: {"group_name": name, "exported": users, "status": "ok"/"failed", "csv_file": csv_file}}.
+    '''
+    rows = queue.Queue(maxsize=max(group_workers, 1) * limit * 2)
+    finished = object()
+    stop = stop or threading.Event()
+    results = {group.get("id"): {"group_name": group.get("name"), "exported": 0, "status": "ok", "csv_file": csv_file}
+               for group in groups}
+
+    def fetch(group):
+        try:
+            for user_record in iterUserRecords(x, group.get("id"), limit=limit, on_total=progress.addTotal):
+                if stop.is_set():
+                    break
+                row = user_record.asRow()
+                row.update({"group_id": group.get("id"), "group_name": group.get("name")})
+                rows.put(row)
+        except (Exception, SystemExit) as e:
+            logging.error(f"Failed to export group {group.get('name')}: {e!r}")
+            results[group.get("id")]["status"] = "failed"
+        finally:
+            rows.put(finished)
+
+    logging.info(f"Writing {len(groups)} groups to csv file - {csv_file}")
+    with Progress(f"Exporting {len(groups)} groups", metrics=x.metrics) as progress, \
+            CsvJournal(csv_file, SNAPSHOT_FIELDS, flush_every=EXPORT_FLUSH_EVERY) as writer, \
+            ThreadPoolExecutor(max_workers=max(min(group_workers, len(groups)), 1)) as executor:
+        for group in groups:
+            executor.submit(fetch, group)
+        remaining = len(groups)
+        try:
+            while remaining:
+                row = rows.get()
+                if row is finished:
+                    remaining -= 1
+                    continue
+                writer.writerow(row)
+                results[row["group_id"]]["exported"] += 1
+                progress.advance()
+        except BaseException:
+            # let the fetchers run out instead of leaving them blocked on the full queue
+            stop.set()
+            while remaining:
+                if rows.get() is finished:
+                    remaining -= 1
+            raise
+    return results
+
+
+def rotateGroup(x, group_id, csv_file, workers=1, checkpoint_file=None, resume=False, limit=100, results=None,
+                policy=None, spread=None, spread_batch=1, max_workers=None, failures_file=None,
+                deferred_retry=DEFERRED_RETRY, verify=False, stop=None, force=False):
+    '''
+    Regenerate the password of every user in a group and journal the results to csv_file.
+    Completed users are recorded in checkpoint_file (default <csv_file>.checkpoint). With resume=True
+    users already completed for this group are skipped and csv_file is appended to instead of replaced.
+    Without resume a ValueError is raised if checkpoint_file already records users of this group, unless
+    force=True: both files would otherwise be replaced.
+    Pass a UserRecords container as results to also keep a record of every user listed, with new_pw set on the
+    rotated ones. verify=True re-reads the group afterwards and checks those records against XIQ (lib/verify.py),
+    writing any problem to <csv_file>.verify.json and adding verified/mismatched/missing/added to the result.
+    With a RotationPolicy (lib/policy.py) only the users it finds due are regenerated, the others are
+    never sent a regenerate-password call.
+    spread - seconds to spread the regenerations over (see lib/pacing.py), spread_batch users at a time. The
+    window's end is saved next to the checkpoint so a resumed run finishes within the original window.
+    max_workers - adapt the number of calls in flight between 1 and max_workers (see lib/concurrency.py).
+    A user whose call fails does not stop the rotation: users that ran out of retries are queued and tried again
+    after the main pass under deferred_retry, the ones that still fail (or failed for good, ex. 404) are written
+    to failures_file (default <csv_file>.failures.json) as a json list. They are not checkpointed, so a --resume
+    run picks them up again.
+    Setting the threading.Event stop ends the rotation early: no more users are submitted, the calls already in
+    flight are journaled and the deferred users are written to failures_file.
+    Returns a dict with the number of users rotated, skipped (resume), not_due (policy) and failed.
+    '''
+    stop = stop or threading.Event()
+    if checkpoint_file is None:
+        checkpoint_file = csv_file + ".checkpoint"
+    if failures_file is None:
+        failures_file = csv_file + ".failures.json"
+    if not (resume or force):
+        checkNoEarlierRun(checkpoint_file, group_id)
+    summary = {"rotated": 0, "skipped": 0, "not_due": 0, "failed": 0}
+    if verify and results is None:
+        results = UserRecords()
+    failures = []
+    engine = RotationEngine(x, workers=workers, max_workers=max_workers, stop=stop)
+
+    with Checkpoint(checkpoint_file, resume=resume) as checkpoint, \
+            Progress(f"Rotating group {group_id}", metrics=x.metrics) as progress:
+        completed = checkpoint.completed(group_id)
+        if resume:
+            logging.info(f"Resuming from {checkpoint_file} - {len(completed)} users were already rotated")
+
+        def pending_users():
+            for data_record in x.iterUsersByGroupID(group_id, limit=limit, on_total=progress.setTotal):
+                user_record = UserRecord.fromApi(data_record)
+                if results is not None:
+                    results.add(user_record)
+                if str(data_record.get("id")) in completed:
+                    summary["skipped"] += 1
+                    progress.skip()
+                    continue
+                if policy is not None and not policy.isDue(data_record):
+                    summary["not_due"] += 1
+                    progress.skip()
+                    continue
+                yield user_record
+
+        if policy is not None:
+            logging.info(f"Only rotating {policy.describe()}")
+        users = pending_users()
+        pacer = None
+        if spread:
+            # pacing needs the number of users up front, the list of pending users is kept as compact records
+            users = list(users)
+            pacer = Pacer(len(users), pacedWindow(PaceState(checkpoint_file + ".pace"), group_id, spread, resume),
+                          batch=spread_batch)
+            logging.info(f"Pacing {pacer.describe()}")
+        logging.info(f"Writing to csv file - {csv_file}")
+        # each row is journaled to disk as soon as its password has been regenerated, and the checkpoint
+        # only records users whose rows are already on disk
+        # a paced run writes rows far apart, so every row is flushed instead of waiting for the next one
+        with CsvJournal(csv_file, ROTATE_FIELDS, append=resume, flush_every=1 if spread else 25) as writer:
+            writer.addFlushListener(checkpoint.commit)
+
+            def journal(rotated, deferred):
+                # deferred is None on the last attempt, every failure is then final
+                for user_record, new_pw, error in rotated:
+                    if error is not None:
+                        if error.retryable and deferred is not None:
+                            deferred.append(user_record)
+                        else:
+                            failures.append({"group_id": group_id, "xiq_id": user_record.xiq_id,
+                                             "user_name": user_record.user_name, "error": str(error),
+                                             "status_code": error.status_code, "retryable": error.retryable})
+                            progress.advance(failed=True)
+                        continue
+                    user_record.new_pw = new_pw
+                    writer.writerow(user_record.asRow())
+                    checkpoint.record(group_id, user_record.xiq_id)
+                    summary["rotated"] += 1
+                    progress.advance()
+
+            deferred = [] if deferred_retry is not None else None
+            journal(engine.rotate(users, pacer=pacer), deferred)
+            rounds = deferred_retry.max_attempts if deferred_retry is not None else 0
+            for attempt in range(1, rounds + 1):
+                if not deferred:
+                    break
+                if x.deadlineReached() or stop.is_set():
+                    reason = "Run deadline reached" if x.deadlineReached() else "Run stopped"
+                    journal(((user_record, None, XIQError(f"{reason} before the deferred retry"))
+                             for user_record in deferred), None)
+                    break
+                delay = deferred_retry.delay(attempt)
+                if x.deadline is not None:
+                    delay = min(delay, max(x.timeLeft(), 0))
+                logging.warning(f"Retrying {len(deferred)} failed users in {delay:.0f}s "
+                                f"(deferred attempt {attempt} of {rounds})")
+                stop.wait(delay)
+                retry_users, deferred = deferred, [] if attempt < rounds else None
+                journal(engine.rotate(retry_users), deferred)
+
+    summary["failed"] = len(failures)
+    if failures:
+        atomicWrite(failures_file, json.dumps(failures, indent=2))
+        logging.error(f"Failed to rotate {len(failures)} users, see {failures_file}")
+    elif os.path.exists(failures_file):
+        # left by an earlier run whose failed users have now been rotated
+        os.remove(failures_file)
+    if summary["skipped"]:
+        logging.info(f"Skipped {summary['skipped']} users already rotated by the interrupted run")
+    if policy is not None:
+        logging.info(f"Policy skipped {summary['not_due']} regenerate-password calls for users not due for rotation")
+    if verify:
+        if x.deadlineReached():
+            logging.warning(f"Run deadline reached, group {group_id} was not verified")
+        else:
+            summary.update(verifyGroup(x, group_id, results, limit=limit, report_file=csv_file + ".verify.json"))
+    return summary
@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.rotation import exportGroup, rotateGroup
+from lib.group_catalog import GroupCatalog
+from lib.policy import RotationPolicy, parseDuration
+from lib.batch import resolveGroups, selectAccounts
+from lib.atomic_file import atomicWrite
+
+JOB_ACTIONS = ("export", "rotate")
+# a failed job is tried again after this long (or its own cadence, if shorter) instead of waiting a full cycle
+FAILED_JOB_RETRY = 900
+# external account clients are made again (new token and connections) after this long
+ACCOUNT_CLIENT_TTL = 6 * 3600
+# requests per second shared by every job when --schedule is given without --rate-limit
+SCHEDULE_RATE_LIMIT = 10
+
+
+def addScheduleArguments(parser):
+    parser.add_argument('--schedule', default=None, help='Optional - run as a daemon executing the jobs of this json schedule file')
+    parser.add_argument('--schedule-state', dest='schedule_state', default=None, help='file remembering when each scheduled job last ran (default <schedule>.state)')
+    parser.add_argument('--job-workers', dest='job_workers', type=int, default=2, help='number of scheduled jobs allowed to run at the same time (default 2)')
+    parser.add_argument('--run-once', dest='run_once', action="store_true", help='Optional - run the scheduled jobs that are due and exit instead of staying up')
+
+
+class ScheduledJob:
+    '''
+    One entry of the schedule file:
+        {"name": "guests-weekly", "group": "Guests", "account": "Customer A", "action": "rotate",
+         "every": "7d", "output": "/var/xiq/guests_%Y%m%d.csv", "min_age": "90d", "spread": "4h"}
+    account (an external VIQ name), min_age and spread (pace the rotation over this long) are optional, action defaults to export and
+    output may contain strftime placeholders, expanded when the job starts.
+    '''
+    def __init__(self, name, group, every, output, action="export", account=None, min_age=None, spread=None):
+        if action not in JOB_ACTIONS:
+            raise ValueError(f"Scheduled job {name}: action must be one of {', '.join(JOB_ACTIONS)}")
+        self.name = name
+        self.group = group
+        self.every = parseDuration(every)
+        if self.every <= 0:
+            raise ValueError(f"Scheduled job {name}: every must be longer than 0")
+        self.output = output
+        self.action = action
+        self.account = account
+        self.policy = RotationPolicy(min_age=parseDuration(min_age)) if min_age else None
+        self.spread = parseDuration(spread) if spread else None
+
+    @classmethod
+    def fromDict(cls, entry):
+        missing = [field for field in ("group", "every", "output") if not entry.get(field)]
+        if missing:
+            raise ValueError(f"Scheduled job {entry.get('name', entry)} is missing {', '.join(missing)}")
+        return cls(entry.get("name") or entry["group"], entry["group"], entry["every"], entry["output"],
+                   action=entry.get("action", "export"), account=entry.get("account"), min_age=entry.get("min_age"),
+                   spread=entry.get("spread"))
+
+
+def loadSchedule(path):
+    '''Read the schedule file ({"jobs": [...]}) and return its ScheduledJobs. Raises ValueError when it is invalid.'''
+    try:
+        with open(path) as file:
+            data = json.load(file)
+    except (OSError, json.JSONDecodeError) as e:
+        raise ValueError(f"Unable to read schedule {path}: {e}")
+    jobs = [ScheduledJob.fromDict(entry) for entry in data.get("jobs", [])]
+    names = [job.name for job in jobs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Scheduled job names must be unique: {', '.join(duplicates)}")
+    if not jobs:
+        raise ValueError(f"Schedule {path} has no jobs")
+    return jobs
+
+
+class ScheduleDaemon:
+    '''
+    Long running replacement for one cron entry per group. One logged in XIQ client (pooled session,
+    token renewed by the client when XIQ rejects it) serves every job; external accounts get a client
+    made once with forAccount and reused. All clients share the home client's TokenBucket, so jobs running
+    at the same time stay inside a single request rate budget. User group listings are kept per account
+    for catalog_options["ttl"] seconds. When each job last ran is kept in state_file, so a restart does not
+    run every job again.
+    '''
+    def __init__(self, x, jobs, state_file, job_workers=2, workers=1, limit=100, catalog_options=None,
+                 max_workers=None):
+        self.x = x
+        self.jobs = jobs
+        self.state_file = state_file
+        self.job_workers = max(job_workers, 1)
+        self.workers = workers
+        self.max_workers = max_workers
+        self.limit = limit
+        self.catalog_options = dict(catalog_options or {})
+        self.state = self.__readState()
+        self.__running = {}
+        self.__clients = {}
+        self.__catalogs = {}
+        self.__accounts = None
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        # set when a job finishes or the daemon is stopped, so the loop never sleeps past either
+        self.__wakeup = threading.Event()
+
+    def __readState(self):
+        try:
+            with open(self.state_file) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def __saveRun(self, job_name, entry):
+        with self.__lock:
+            self.state[job_name] = entry
+            atomicWrite(self.state_file, json.dumps(self.state, indent=2))
+
+    def nextRun(self, job):
+        entry = self.state.get(job.name)
+        if not entry:
+            return 0
+        # a "running" entry left by a daemon that died mid-job is retried like a failed job
+        delay = job.every if entry.get("status") == "ok" else min(job.every, FAILED_JOB_RETRY)
+        return entry.get("last_run", 0) + delay
+
+    def __client(self, account_name):
+        if not account_name:
+            return self.x
+        with self.__lock:
+            client, created = self.__clients.get(account_name, (None, 0))
+            if client is not None and created + ACCOUNT_CLIENT_TTL > time.time():
+                return client
+            if self.__accounts is None:
+                self.__accounts = {account.get("name"): account for account in selectAccounts(self.x)}
+            account = self.__accounts.get(account_name)
+            if account is None:
+                raise ValueError(f"External account not found: {account_name}")
+            if client is not None:
+                client.close()
+            client = self.x.forAccount(account.get("id"), account_name, rate_limiter=self.x.rate_limiter)
+            self.__clients[account_name] = (client, time.time())
+            self.__catalogs.pop(account_name, None)
+            return client
+
+    def __catalog(self, client, account_name):
+        with self.__lock:
+            catalog = self.__catalogs.get(account_name)
+            ttl = self.catalog_options.get("ttl") or 0
+            # a catalog that has not loaded its listing yet has no fetched_at, keep it
+            if catalog is None or (catalog.fetched_at is not None and catalog.fetched_at + ttl < time.time()):
+                catalog = GroupCatalog(client, limit=self.limit, **self.catalog_options)
+                self.__catalogs[account_name] = catalog
+            return catalog
+
+    def runJob(self, job):
+        started = time.time()
+        csv_file = time.strftime(job.output, time.localtime(started))
+        where = f" in {job.account}" if job.account else ""
+        logging.info(f"Scheduled job {job.name}: {job.action} of group {job.group}{where} -> {csv_file}")
+        previous = self.state.get(job.name) or {}
+        # a rotation that failed or was cut short (the daemon died) writing the same file picks up where it stopped
+        resume = (job.action == "rotate" and previous.get("status") != "ok" and previous.get("csv_file") == csv_file
+                  and os.path.exists(csv_file + ".checkpoint"))
+        entry = {"last_run": started, "csv_file": csv_file}
+        self.__saveRun(job.name, dict(entry, status="running"))
+        try:
+            client = self.__client(job.account)
+            group = resolveGroups(self.__catalog(client, job.account), names=[job.group])[0]
+            if job.action == "rotate":
+                if resume:
+                    logging.info(f"Scheduled job {job.name}: resuming the unfinished run from its checkpoint")
+                # otherwise a checkpoint of the same file is left by a finished run, this is the next cycle
+                entry.update(rotateGroup(client, group.get("id"), csv_file, workers=self.workers, resume=resume,
+                                         force=True, limit=self.limit, policy=job.policy, spread=job.spread,
+                                         max_workers=self.max_workers))
+            else:
+                entry["exported"] = exportGroup(client, group.get("id"), csv_file, limit=self.limit)
+            entry["status"] = "ok"
+        except (Exception, SystemExit) as e:
+            logging.error(f"Scheduled job {job.name} failed: {e!r}")
+            entry["status"] = "failed"
+        entry["duration"] = round(time.time() - started, 3)
+        self.__saveRun(job.name, entry)
+        logging.info(f"Scheduled job {job.name}: {entry['status']} in {entry['duration']:g}s")
+        return entry
+
+    def stop(self):
+        self.__stop.set()
+        self.__wakeup.set()
+
+    def run(self, once=False):
+        '''
+        Start every job that is due (at most job_workers at a time, never two runs of the same job) and sleep
+        until the next one is due. With once=True only the jobs due now are run, then run() returns.
+        '''
+        if self.x.rate_limiter is None:
+            logging.warning("No --rate-limit given, scheduled jobs share the session but not a request budget")
+        logging.info(f"Schedule loaded with {len(self.jobs)} jobs")
+        with ThreadPoolExecutor(max_workers=self.job_workers) as executor:
+            while not self.__stop.is_set():
+                self.__wakeup.clear()
+                now = time.time()
+                for name, future in list(self.__running.items()):
+                    if future.done():
+                        del self.__running[name]
+                for job in self.jobs:
+                    if job.name not in self.__running and self.nextRun(job) <= now:
+                        future = executor.submit(self.runJob, job)
+                        future.add_done_callback(lambda done: self.__wakeup.set())
+                        self.__running[job.name] = future
+                if once:
+                    for future in self.__running.values():
+                        future.result()
+                    self.__running.clear()
+                    break
+                next_due = min((self.nextRun(job) for job in self.jobs if job.name not in self.__running),
+                               default=now + 60)
+                self.__wakeup.wait(min(max(next_due - time.time(), 0), 60))
+            if self.__running:
+                logging.info(f"Waiting for {len(self.__running)} running jobs to finish")
+        for client, created in self.__clients.values():
+            client.close()
+
+
+def runScheduleFromArgs(x, args, workers=1, limit=100):
+    '''Entry point used by the scripts when --schedule is given.'''
+    if args.deadline:
+        logging.error("--deadline cannot be used with --schedule, the daemon has no end")
+        raise SystemExit(1)
+    try:
+        jobs = loadSchedule(args.schedule)
+    except ValueError as e:
+        logging.error(e)
+        raise SystemExit(1)
+    if any(job.action == "rotate" for job in jobs) and not args.yes:
+        logging.error("The schedule rotates passwords, confirm it with --yes, exiting...")
+        raise SystemExit(1)
+    daemon = ScheduleDaemon(x, jobs, args.schedule_state or args.schedule + ".state", job_workers=args.job_workers,
+                            workers=workers, limit=limit, max_workers=args.adaptive_workers,
+                            catalog_options={"cache_file": args.group_cache, "ttl": args.group_cache_ttl,
+                                             "refresh": args.refresh_groups})
+    if threading.current_thread() is threading.main_thread():
+        import signal
+        signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    try:
+        daemon.run(once=args.run_once)
+    except KeyboardInterrupt:
+        daemon.stop()
+    return daemon.state
@@ -0,0 +1,85 @@
+import base64
+import json
+import os
+import threading
+import time
+
+from lib.atomic_file import atomicWrite
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".xiq", "token_cache.json")
+
+
+def tokenExpiry(data, access_token, default_lifetime=3600):
+    '''
+    Work out when a token from /login expires (epoch seconds): "expires_in" from the response if present,
+    otherwise the "exp" claim of the JWT, otherwise default_lifetime from now.
+    '''
+    if data.get("expires_in"):
+        return time.time() + float(data["expires_in"])
+    try:
+        claims = access_token.split(".")[1]
+        claims += "=" * (-len(claims) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(claims))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return time.time() + default_lifetime
+
+
+class TokenCache:
+    '''
+    Local cache of XIQ login state so repeated and scheduled runs can skip /login and the /account calls.
+    One entry per login (XIQ url + user name) holding the bearer token, its expiry, the home VIQ name/id and
+    the list of external accounts. The file is only readable by the current user (0600 in a 0700 folder)
+    and is replaced atomically on every write.
+    '''
+    def __init__(self, path=DEFAULT_CACHE_FILE, expiry_margin=60, accounts_ttl=24 * 3600):
+        # expiry_margin - seconds before expiry at which a cached token is no longer handed out
+        # accounts_ttl - seconds the VIQ info and external account list are reused
+        self.path = path
+        self.expiry_margin = expiry_margin
+        self.accounts_ttl = accounts_ttl
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def loginKey(url, user_name):
+        return f"{url}|{str(user_name).lower()}"
+
+    def __read(self):
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def __write(self, entries):
+        atomicWrite(self.path, json.dumps(entries), mode=0o600)
+
+    def __update(self, key, values):
+        with self.__lock:
+            entries = self.__read()
+            entries.setdefault(key, {}).update(values)
+            self.__write(entries)
+
+    def getToken(self, key):
+        entry = self.__read().get(key, {})
+        if entry.get("access_token") and entry.get("expires_at", 0) - self.expiry_margin > time.time():
+            return entry["access_token"]
+        return None
+
+    def putToken(self, key, access_token, expires_at):
+        self.__update(key, {"access_token": access_token, "expires_at": expires_at})
+
+    def getAccountContext(self, key):
+        entry = self.__read().get(key, {})
+        if "external_accounts" in entry and entry.get("accounts_cached_at", 0) + self.accounts_ttl > time.time():
+            return entry
+        return None
+
+    def putAccountContext(self, key, viq_name, viq_id, external_accounts):
+        self.__update(key, {"viq_name": viq_name, "viq_id": viq_id, "external_accounts": external_accounts,
+                            "accounts_cached_at": time.time()})
+
+    def invalidate(self, key):
+        with self.__lock:
+            entries = self.__read()
+            if entries.pop(key, None) is not None:
+                self.__write(entries)
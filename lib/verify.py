@@ -0,0 +1,58 @@
+import json
+import logging
+import os
+
+from lib.progress import Progress
+from lib.atomic_file import atomicWrite
+
+
+def verifyGroup(x, group_id, results, limit=100, report_file=None):
+    '''
+    Re-read a group after a rotation and check that XIQ holds the passwords the rotation recorded.
+    results is the UserRecords the rotation filled (every user it listed, new_pw set on the rotated ones);
+    the group is listed again with the concurrent page fetcher and every user is looked up by id, so this
+    costs one parallel listing whatever the group size. A user is:
+    - mismatched when XIQ's password differs from new_pw (or from existing_pw for a user the rotation left alone)
+    - missing when it was listed by the rotation but is no longer in the group
+    - added when it is in the group but was not listed by the rotation (created or moved in mid-run)
+    Problems are written to report_file as json, a stale report is removed when there are none.
+    Returns a dict with the number of users verified, mismatched, missing and added.
+    '''
+    problems = []
+    seen = set()
+    verified = 0
+    with Progress(f"Verifying group {group_id}", metrics=x.metrics) as progress:
+        for data_record in x.iterUsersByGroupID(group_id, limit=limit, on_total=progress.setTotal):
+            xiq_id = data_record.get("id")
+            record = results.get(xiq_id)
+            progress.advance()
+            if record is None:
+                problems.append({"issue": "added", "xiq_id": xiq_id, "user_name": data_record.get("user_name")})
+                continue
+            seen.add(xiq_id)
+            expected = record.new_pw if record.new_pw is not None else record.existing_pw
+            if data_record.get("password") != expected:
+                problems.append({"issue": "mismatched", "xiq_id": xiq_id, "user_name": record.user_name,
+                                 "rotated": record.new_pw is not None})
+                continue
+            verified += 1
+    for record in results:
+        if record.xiq_id not in seen:
+            problems.append({"issue": "missing", "xiq_id": record.xiq_id, "user_name": record.user_name})
+
+    summary = {"verified": verified, "mismatched": 0, "missing": 0, "added": 0}
+    for problem in problems:
+        summary[problem["issue"]] += 1
+    logging.info(f"Verified {verified} users of group {group_id}: {summary['mismatched']} mismatched, "
+                 f"{summary['missing']} missing, {summary['added']} added during the run")
+    if report_file is None:
+        return summary
+    if problems:
+        atomicWrite(report_file, json.dumps(problems, indent=2))
+        if summary["mismatched"]:
+            logging.error(f"XIQ does not hold the expected password of {summary['mismatched']} users, see {report_file}")
+        else:
+            logging.warning(f"The group changed during the rotation, see {report_file}")
+    elif os.path.exists(report_file):
+        os.remove(report_file)
+    return summary
@@ -3,30 +3,96 @@ import os
 import inspect
 import sys
 import json
+import threading
+import time
 import requests
-import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
 current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 parent_dir = os.path.dirname(current_dir)
 sys.path.insert(0, parent_dir) 
 from requests.exceptions import HTTPError
-from lib.logger import CustomLogger
-custom_logger = CustomLogger()
-logger = custom_logger.create_logger()
+from lib.retry import RetryPolicy, RetryableError, TokenBucket, isRetryableStatus, parseRetryAfter
+from lib.token_cache import TokenCache, tokenExpiry
+from lib.metrics import ApiMetrics, endpointName
+from lib.circuit import CircuitBreaker
+# handlers are attached by the scripts (CustomLogger().create_logger()) so importing lib has no side effects
+logger = logging.getLogger()
 
 PATH = current_dir
 
+
+class XIQError(Exception):
+    '''
+    An API call that failed for good, raised instead of SystemExit when the caller asks for it (raise_errors=True)
+    so one failed item does not end the script. retryable is True when the call only ran out of attempts
+    (429, 5xx, connection errors) and may succeed later.
+    '''
+    def __init__(self, message, status_code=None, retryable=False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+
+
+class DeadlineExceeded(Exception):
+    '''The run deadline passed before the call could be made.'''
+
+
 class XIQ:
-    def __init__(self, user_name=None, password=None, token=None):
-        self.URL = "https://api.extremecloudiq.com"
+    DEFAULT_URL = "https://api.extremecloudiq.com"
+
+    def __init__(self, user_name=None, password=None, token=None, pool_connections=10, pool_maxsize=10, keep_alive=True, page_workers=8,
+                 retry_policy=None, rate_limit=None, rate_limiter=None, token_cache=None, base_url=None, metrics=None,
+                 timeout=(10, 60), deadline=None, circuit_breaker=None, password_prompt=None):
+        # rate_limit - max requests per second for this client, or pass a shared TokenBucket as rate_limiter
+        # token_cache - optional TokenCache, reused instead of /login while its token is valid
+        # metrics - ApiMetrics collecting per-endpoint latency/retries/errors, can be shared between clients
+        # timeout - (connect, read) seconds for every request
+        # deadline - seconds from now after which no more requests are sent (DeadlineExceeded)
+        # circuit_breaker - CircuitBreaker pausing requests while XIQ keeps failing, one is made if not given
+        # password_prompt - called for the password when a login is needed and none was given (ex. a cached
+        #                   token was used and XIQ rejected it)
+        self.URL = (base_url or self.DEFAULT_URL).rstrip("/")
         self.headers = {"Accept": "application/json", "Content-Type": "application/json"}
-        self.totalretries = 5
-        self.locationTree_df = pd.DataFrame(columns = ['id', 'name', 'type', 'parent'])
-        if token:
-            self.headers["Authorization"] = "Bearer " + token
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.totalretries = self.retry_policy.max_attempts
+        self.rate_limit = rate_limit
+        if rate_limiter is None and rate_limit:
+            rate_limiter = TokenBucket(rate_limit)
+        self.rate_limiter = rate_limiter
+        self.page_workers = page_workers
+        self.metrics = metrics or ApiMetrics()
+        self.timeout = timeout
+        self.deadline = None if deadline is None else time.monotonic() + deadline
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.__last_endpoint = threading.local()
+        self.pool_options = {"pool_connections": pool_connections, "pool_maxsize": pool_maxsize, "keep_alive": keep_alive}
+        self.__createSession(pool_connections, pool_maxsize, keep_alive)
+        self.token_cache = token_cache
+        self.__user_name = user_name
+        self.__password = password
+        self.__password_prompt = password_prompt
+        self.__switched_account = None
+        # (parent client, viqID, viqName) for clients made by forAccount, used to renew their token
+        self.__token_source = None
+        self.__token_lock = threading.RLock()
+        # connection stats of the clients made by forAccount, per VIQ name, handed over when they are closed
+        self.account_connections = {}
+        self.__stats_lock = threading.Lock()
+        self.__closed = False
+        self.__refreshing = False
+        cached_token = None
+        if not token and token_cache is not None and user_name:
+            cached_token = token_cache.getToken(self.__cacheKey())
+            if cached_token:
+                logging.info("Using cached XIQ token")
+        if token or cached_token:
+            self.headers["Authorization"] = "Bearer " + (token or cached_token)
         else:
             try:
-                self.__getAccessToken(user_name, password)
+                self.__getAccessToken(user_name, self.__loginPassword())
             except ValueError as e:
                 logging.error(e)
                 raise SystemExit
@@ -37,102 +103,241 @@ class XIQ:
                 log_msg = "Unknown Error: Failed to generate token for XIQ"
                 logger.error(log_msg)
                 raise SystemExit
-    #API CALLS
-    def __setup_get_api_call(self, info, url):
-        success = 0
-        for count in range(1, self.totalretries):
+    #TOKEN CACHE
+    def __cacheKey(self):
+        return TokenCache.loginKey(self.URL, self.__user_name)
+
+    def __loginPassword(self):
+        # the password is only asked for when a login actually has to happen
+        if not self.__password and self.__password_prompt is not None:
+            self.__password = self.__password_prompt()
+        return self.__password
+
+    def __canRefreshToken(self):
+        # never refresh from inside a refresh (the login or account switch itself was rejected)
+        has_password = bool(self.__password) or self.__password_prompt is not None
+        can_login = bool(self.__user_name and has_password) or self.__token_source is not None
+        return can_login and not self.__refreshing
+
+    def __refreshToken(self, stale_auth):
+        # several threads may see the same 401, only the first one logs in again
+        with self.__token_lock:
+            if self.headers.get("Authorization") != stale_auth:
+                return
+            logger.info("XIQ token was rejected, logging in again")
+            if self.token_cache is not None:
+                self.token_cache.invalidate(self.__cacheKey())
+            self.__refreshing = True
             try:
-                response = self.__get_api_call(url=url)
-            except ValueError as e:
-                logging.warning(f"API to {info} failed attempt {count} of {self.totalretries} with {e}")
-            except Exception as e:
-                logging.error(f"API to {info} failed with {e}")
-                logging.info('script is exiting...')
-                raise SystemExit
-            except:
-                logging.error(f"API to {info} failed attempt {count} of {self.totalretries} with unknown API error")
-            else:
-                success = 1
-                break
-        if success != 1:
-            logging.error("failed to {}. Cannot continue to import".format(info))
+                if self.__token_source is not None:
+                    parent, viqID, viqName = self.__token_source
+                    self.headers["Authorization"] = "Bearer " + parent.getAccountToken(viqID, viqName)
+                    return
+                self.__getAccessToken(self.__user_name, self.__loginPassword())
+                if self.__switched_account:
+                    viqID, viqName = self.__switched_account
+                    self.headers["Authorization"] = "Bearer " + self.getAccountToken(viqID, viqName)
+            finally:
+                self.__refreshing = False
+
+    #HTTP SESSION
+    def __createSession(self, pool_connections, pool_maxsize, keep_alive):
+        # pool_connections - number of per-host pools to cache
+        # pool_maxsize - max connections kept open to a single host
+        self.session = requests.Session()
+        self.__adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", self.__adapter)
+        self.session.mount("http://", self.__adapter)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+
+    def getConnectionStats(self):
+        requests_sent = 0
+        connections_opened = 0
+        pools = self.__adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            requests_sent += pool.num_requests
+            connections_opened += pool.num_connections
+        return {
+            "requests": requests_sent,
+            "connections": connections_opened,
+            "reused": max(requests_sent - connections_opened, 0)
+        }
+
+    def logConnectionStats(self):
+        stats = self.getConnectionStats()
+        logger.info(f"HTTP connections: {stats['requests']} requests over {stats['connections']} connections "
+                    f"({stats['reused']} reused)")
+        for viq_name, account_stats in sorted(self.account_connections.items()):
+            logger.info(f"HTTP connections in {viq_name}: {account_stats['requests']} requests over "
+                        f"{account_stats['connections']} connections ({account_stats['reused']} reused)")
+        return stats
+
+    def __addAccountConnections(self, viq_name, stats):
+        with self.__stats_lock:
+            total = self.account_connections.setdefault(viq_name, {"requests": 0, "connections": 0, "reused": 0})
+            for key, value in stats.items():
+                total[key] += value
+
+    def close(self):
+        # a client made by forAccount hands its connection stats to the client it was made from before its
+        # pool goes away, so the end of run report covers every account
+        with self.__stats_lock:
+            if self.__closed:
+                return
+            self.__closed = True
+        if self.__token_source is not None:
+            parent = self.__token_source[0]
+            parent.__addAccountConnections(self.__token_source[2], self.getConnectionStats())
+        self.session.close()
+
+    def timeLeft(self):
+        # seconds until the run deadline, None without a deadline
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def deadlineReached(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    #API CALLS
+    def __callWithRetry(self, info, call, fatal=True, raise_errors=False):
+        '''
+        Run call() under the retry policy. ValueError (including RetryableError for 429/5xx/connection errors)
+        is retried with exponential backoff and jitter, honouring Retry-After. Any other exception is fatal.
+        Returns call()'s result. When all attempts fail, raises SystemExit, or returns None if fatal is False,
+        or raises XIQError if raise_errors is True.
+        '''
+        attempts = self.retry_policy.max_attempts
+        failures = []
+        try:
+            for count in range(1, attempts + 1):
+                try:
+                    return call()
+                except ValueError as e:
+                    failures.append(getattr(e, "status_code", None) if isinstance(e, RetryableError) else "error")
+                    logging.warning(f"API to {info} failed attempt {count} of {attempts} with {e}")
+                    if count < attempts:
+                        self.metrics.recordRetry(getattr(self.__last_endpoint, "name", "unknown"))
+                        delay = self.retry_policy.delay(count, getattr(e, "retry_after", None))
+                        if self.deadline is not None:
+                            # never back off past the run deadline, the next attempt then fails straight away
+                            delay = min(delay, max(self.timeLeft(), 0))
+                        time.sleep(delay)
+                except Exception as e:
+                    logging.error(f"API to {info} failed with {e}")
+                    if raise_errors:
+                        raise XIQError(f"API to {info} failed with {e}", getattr(e, "status_code", None)) from e
+                    if not fatal:
+                        return None
+                    logging.info('script is exiting...')
+                    raise SystemExit
+            if raise_errors:
+                logging.error(f"failed to {info} after {attempts} attempts")
+                last_status = failures[-1] if failures and isinstance(failures[-1], int) else None
+                raise XIQError(f"failed to {info} after {attempts} attempts", last_status, retryable=True)
+            logging.error(f"failed to {info}. Cannot continue")
+            if not fatal:
+                return None
             logging.info("exiting script...")
             raise SystemExit
+        finally:
+            # set once the call is over, so a nested call (token refresh) cannot replace it
+            self.__last_endpoint.failures = failures
+
+    def __checkErrorResponse(self, info, response, raise_errors=False):
         if 'error' in response:
-            if response['error_mssage']:
+            if response.get('error_message'):
                 log_msg = (f"Status Code {response['error_id']}: {response['error_message']}")
                 logger.error(log_msg)
                 logging.error(f"API Failed {info} with reason: {log_msg}")
+                if raise_errors:
+                    raise XIQError(f"API Failed {info} with reason: {log_msg}")
                 logging.info("Script is exiting...")
                 raise SystemExit
+
+    def __setup_get_api_call(self, info, url):
+        response = self.__callWithRetry(info, lambda: self.__get_api_call(url=url))
+        self.__checkErrorResponse(info, response)
         return response
-        
-    def __setup_post_api_call(self, info, url, payload):
-        success = 0
-        for count in range(1, self.totalretries):
-            try:
-                response = self.__post_api_call(url=url, payload=payload)
-            except ValueError as e:
-                logging.error(f"API to {info} failed attempt {count} of {self.totalretries} with {e}")
-            except Exception as e:
-                logging.error(f"API to {info} failed with {e}")
-                logging.info('script is exiting...')
-                raise SystemExit
-            except:
-                logging.error(f"API to {info} failed attempt {count} of {self.totalretries} with unknown API error")
-            else:
-                success = 1
-                break
-        if success != 1:
-            logging.error("failed {}. Cannot continue to import".format(info))
-            logging.info("exiting script...")
-            raise SystemExit
-        if 'error' in response:
-            if response['error_mssage']:
-                log_msg = (f"Status Code {response['error_id']}: {response['error_message']}")
-                logger.error(log_msg)
-                logging.error(f"API Failed {info} with reason: {log_msg}")
-                logging.info("Script is exiting...")
-                raise SystemExit
+
+    def __setup_post_api_call(self, info, url, payload, raise_errors=False):
+        response = self.__callWithRetry(info, lambda: self.__post_api_call(url=url, payload=payload),
+                                        raise_errors=raise_errors)
+        self.__checkErrorResponse(info, response, raise_errors)
         return response
-    
+
     def __setup_put_api_call(self, info, url, payload=''):
-        success = 0
-        for count in range(1, self.totalretries):
-            try:
-                if payload:
-                    self.__put_api_call(url=url, payload=payload)
-                else:
-                    self.__put_api_call(url=url)
-            except ValueError as e:
-                logging.error(f"API to {info} failed attempt {count} of {self.totalretries} with {e}")
-            except Exception as e:
-                logging.error(f"API to {info} failed with {e}")
-                logging.info('script is exiting...')
-                raise SystemExit
-            except:
-                logging.error(f"API to {info} failed attempt {count} of {self.totalretries} with unknown API error")
-            else:
-                success = 1
-                break
-        if success != 1:
-            logging.error("failed to {}. Cannot continue to import".format(info))
-            logging.info("exiting script...")
-            raise SystemExit
-        
+        self.__callWithRetry(info, lambda: self.__put_api_call(url=url, payload=payload))
         return 'Success'
 
-
-    def __get_api_call(self, url):
+    def __send(self, method, url, payload=None):
+        # every request goes through the circuit breaker, the client-side rate limiter and the pooled session
+        if self.deadlineReached():
+            raise DeadlineExceeded("Run deadline reached, not sending any more requests")
+        if not self.circuit_breaker.before(timeout=self.timeLeft()):
+            raise DeadlineExceeded("Run deadline reached while XIQ requests were paused by the circuit breaker")
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        sent_auth = self.headers.get("Authorization")
+        endpoint = endpointName(method, url)
+        self.__last_endpoint.name = endpoint
+        bytes_sent = len(payload) if payload else 0
+        start = time.perf_counter()
         try:
-            response = requests.get(url, headers= self.headers)
+            if payload:
+                response = self.session.request(method, url, headers= self.headers, data=payload, timeout=self.timeout)
+            else:
+                response = self.session.request(method, url, headers= self.headers, timeout=self.timeout)
         except HTTPError as http_err:
+            self.circuit_breaker.failure()
+            self.metrics.record(endpoint, type(http_err).__name__, time.perf_counter() - start, bytes_sent)
             logger.error(f'HTTP error occurred: {http_err} - on API {url}')
-            raise ValueError(f'HTTP error occurred: {http_err}') 
+            raise ValueError(f'HTTP error occurred: {http_err}')
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as conn_err:
+            self.circuit_breaker.failure()
+            self.metrics.record(endpoint, type(conn_err).__name__, time.perf_counter() - start, bytes_sent)
+            logger.error(f'Connection error occurred: {conn_err} - on API {url}')
+            raise RetryableError(f'Connection error occurred: {conn_err}')
+        except requests.exceptions.RequestException as req_err:
+            # ex. ChunkedEncodingError, the response broke off mid-transfer
+            self.circuit_breaker.failure()
+            self.metrics.record(endpoint, type(req_err).__name__, time.perf_counter() - start, bytes_sent)
+            logger.error(f'Request error occurred: {req_err} - on API {url}')
+            raise RetryableError(f'Request error occurred: {req_err}')
+        except BaseException:
+            # every request must report back, a half-open breaker otherwise waits for its probe forever
+            self.circuit_breaker.failure()
+            raise
         if response is None:
+            self.circuit_breaker.failure()
             log_msg = "ERROR: No response received from XIQ!"
             logger.error(log_msg)
             raise ValueError(log_msg)
+        self.metrics.record(endpoint, response.status_code, time.perf_counter() - start, bytes_sent,
+                            len(response.content))
+        if response.status_code >= 500:
+            self.circuit_breaker.failure()
+        else:
+            self.circuit_breaker.success()
+        if response.status_code == 401 and self.__canRefreshToken() and not url.endswith("/login"):
+            self.__refreshToken(sent_auth)
+            raise RetryableError("Error - HTTP Status Code: 401, retrying with a new token", status_code=401, retry_after=0)
+        if response.status_code == 401 and self.token_cache is not None and self.__user_name:
+            # a rejected token must not be handed to the next run either, it would skip the login again
+            self.token_cache.invalidate(self.__cacheKey())
+        if isRetryableStatus(response.status_code):
+            retry_after = parseRetryAfter(response.headers.get("Retry-After"))
+            log_msg = f"Error - HTTP Status Code: {str(response.status_code)}"
+            if retry_after is not None:
+                log_msg += f" (Retry-After {retry_after:g}s)"
+            logger.warning(log_msg)
+            raise RetryableError(log_msg, status_code=response.status_code, retry_after=retry_after)
+        return response
+
+    def __get_api_call(self, url):
+        response = self.__send("GET", url)
         if response.status_code != 200:
             log_msg = f"Error - HTTP Status Code: {str(response.status_code)}"
             logger.error(f"{log_msg}")
@@ -153,15 +358,7 @@ class XIQ:
         return data
 
     def __post_api_call(self, url, payload):
-        try:
-            response = requests.post(url, headers= self.headers, data=payload)
-        except HTTPError as http_err:
-            logger.error(f'HTTP error occurred: {http_err} - on API {url}')
-            raise ValueError(f'HTTP error occurred: {http_err}') 
-        if response is None:
-            log_msg = "ERROR: No response received from XIQ!"
-            logger.error(log_msg)
-            raise ValueError(log_msg)
+        response = self.__send("POST", url, payload)
         if response.status_code == 202:
             return "Success"
         elif response.status_code != 200:
@@ -170,11 +367,11 @@ class XIQ:
             try:
                 data = response.json()
             except json.JSONDecodeError:
-                logger.warning(f"\t\t{response.text()}")
+                logger.warning(f"\t\t{response.text}")
             else:
                 if 'error_message' in data:
                     logger.warning(f"\t\t{data['error_message']}")
-                    raise Exception(data['error_message'])
+                    raise XIQError(data['error_message'], response.status_code)
             raise ValueError(log_msg)
         try:
             data = response.json()
@@ -184,18 +381,7 @@ class XIQ:
         return data
     
     def __put_api_call(self, url, payload=''):
-        try:
-            if payload:
-                response = requests.put(url, headers= self.headers, data=payload)
-            else:
-                response = requests.put(url, headers= self.headers)
-        except HTTPError as http_err:
-            logger.error(f'HTTP error occurred: {http_err} - on API {url}')
-            raise ValueError(f'HTTP error occurred: {http_err}') 
-        if response is None:
-            log_msg = "ERROR: No response received from XIQ!"
-            logger.error(log_msg)
-            raise ValueError(log_msg)
+        response = self.__send("PUT", url, payload)
         if response.status_code != 200:
             log_msg = f"Error - HTTP Status Code: {str(response.status_code)}"
             logger.error(f"{log_msg}")
@@ -214,31 +400,15 @@ class XIQ:
 
     def __getAccessToken(self, user_name, password):
         info = "get XIQ token"
-        success = 0
         url = self.URL + "/login"
         payload = json.dumps({"username": user_name, "password": password})
-        for count in range(1, self.totalretries):
-            try:
-                data = self.__post_api_call(url=url,payload=payload)
-            except ValueError as e:
-                logging.error(f"API to {info} failed attempt {count} of {self.totalretries} with {e}")
-            except Exception as e:
-                logging.error(f"API to {info} failed with {e}")
-                logging.info('script is exiting...')
-                raise SystemExit
-            except:
-                logging.error(f"API to {info} failed attempt {count} of {self.totalretries} with unknown API error")
-            else:
-                success = 1
-                break
-        if success != 1:
-            logging.error("failed to get XIQ token. Cannot continue to import")
-            logging.info("exiting script...")
-            raise SystemExit
-        
+        data = self.__callWithRetry(info, lambda: self.__post_api_call(url=url,payload=payload))
+
         if "access_token" in data:
             #print("Logged in and Got access token: " + data["access_token"])
             self.headers["Authorization"] = "Bearer " + data["access_token"]
+            if self.token_cache is not None:
+                self.token_cache.putToken(self.__cacheKey(), data["access_token"], tokenExpiry(data, data["access_token"]))
             return 0
 
         else:
@@ -251,89 +421,91 @@ class XIQ:
     # EXTERNAL ACCOUNTS
     def __getVIQInfo(self):
         info="get current VIQ name"
-        success = 0
         url = "{}/account/home".format(self.URL)
-        for count in range(1, self.totalretries):
-            try:
-                data = self.__get_api_call(url=url)
-            except ValueError as e:
-                logging.error(f"API to {info} failed attempt {count} of {self.totalretries} with {e}")
-            except:
-                logging.error(f"API to {info} failed attempt {count} of {self.totalretries} with unknown API error")
-            else:
-                success = 1
-                break
-        if success != 1:
+        data = self.__callWithRetry(info, lambda: self.__get_api_call(url=url), fatal=False)
+        if data is None:
             logging.error(f"Failed to {info}")
             return 1
-            
+
         else:
             self.viqName = data['name']
             self.viqID = data['id']
             
+    def getViqID(self):
+        # id of the VIQ this client works in, /account/home is only called the first time
+        if getattr(self, "viqID", None) is None:
+            self.__getVIQInfo()
+        return getattr(self, "viqID", None)
+
     #ACCOUNT SWITCH
     def selectManagedAccount(self):
-        self.__getVIQInfo()
+        use_cache = self.token_cache is not None and self.__user_name and not self.__switched_account
+        if use_cache:
+            cached = self.token_cache.getAccountContext(self.__cacheKey())
+            if cached:
+                self.viqName = cached["viq_name"]
+                self.viqID = cached["viq_id"]
+                return(cached["external_accounts"], self.viqName)
+        if self.__getVIQInfo() == 1:
+            return 1
         info="gather accessible external XIQ acccounts"
-        success = 0
         url = "{}/account/external".format(self.URL)
-        for count in range(1, self.totalretries):
-            try:
-                data = self.__get_api_call(url=url)
-            except ValueError as e:
-                logging.error(f"API to {info} failed attempt {count} of {self.totalretries} with {e}")
-            except:
-                logging.error(f"API to {info} failed attempt {count} of {self.totalretries} with unknown API error")
-            else:
-                success = 1
-                break
-        if success != 1:
+        data = self.__callWithRetry(info, lambda: self.__get_api_call(url=url), fatal=False)
+        if data is None:
             logging.error(f"Failed to {info}")
             return 1
-            
+
         else:
+            if use_cache:
+                self.token_cache.putAccountContext(self.__cacheKey(), self.viqName, self.viqID, data)
             return(data, self.viqName)
 
 
-    def switchAccount(self, viqID, viqName):
+    def getAccountToken(self, viqID, viqName):
+        # returns a bearer token for the external account without changing this client's own token
         info=f"switch to external account {viqName}"
-        success = 0
         url = "{}/account/:switch?id={}".format(self.URL,viqID)
         payload = ''
-        for count in range(1, self.totalretries):
-            try:
-                data = self.__post_api_call(url=url, payload=payload)
-            except ValueError as e:
-                logging.error(f"API to {info} failed attempt {count} of {self.totalretries} with {e}")
-            except Exception as e:
-                logging.error(f"API to {info} failed with {e}")
-                logging.info('script is exiting...')
-                raise SystemExit
-            except:
-                logging.error(f"API to {info} failed attempt {count} of {self.totalretries} with unknown API error")
-            else:
-                success = 1
-                break
-        if success != 1:
-            logging.error("failed to get XIQ token to {}. Cannot continue to import".format(info))
-            logging.info("exiting script...")
-            raise SystemExit
-        
-        if "access_token" in data:
-            #print("Logged in and Got access token: " + data["access_token"])
-            self.headers["Authorization"] = "Bearer " + data["access_token"]
-            self.__getVIQInfo()
-            if viqName != self.viqName:
-                logger.error(f"Failed to switch external accounts. Script attempted to switch to {viqName} but is still in {self.viqName}")
-                # print("Failed to switch to external account!!")
-                logging.info("Script is exiting...")
-                raise SystemExit
-            return 0
+        data = self.__callWithRetry(info, lambda: self.__post_api_call(url=url, payload=payload))
 
+        if "access_token" in data:
+            return data["access_token"]
         else:
             log_msg = "Unknown Error: Unable to gain access token for XIQ"
             logger.warning(log_msg)
-            raise ValueError(log_msg) 
+            raise ValueError(log_msg)
+
+    def switchAccount(self, viqID, viqName):
+        access_token = self.getAccountToken(viqID, viqName)
+        #print("Logged in and Got access token: " + access_token)
+        self.headers["Authorization"] = "Bearer " + access_token
+        self.__switched_account = (viqID, viqName)
+        self.__getVIQInfo()
+        if viqName != self.viqName:
+            logger.error(f"Failed to switch external accounts. Script attempted to switch to {viqName} but is still in {self.viqName}")
+            # print("Failed to switch to external account!!")
+            logging.info("Script is exiting...")
+            raise SystemExit
+        return 0
+
+    def forAccount(self, viqID, viqName, rate_limiter=None):
+        '''
+        Return a new, independent XIQ client (own token and connection pool) for an external account.
+        This client keeps its own token, so several accounts can be worked on concurrently. When XIQ rejects
+        that token a new one is requested through this client.
+        rate_limiter - TokenBucket to share with the new client, by default it gets its own --rate-limit budget
+        '''
+        access_token = self.getAccountToken(viqID, viqName)
+        account = XIQ(token=access_token, page_workers=self.page_workers, retry_policy=self.retry_policy,
+                      rate_limit=self.rate_limit, rate_limiter=rate_limiter, base_url=self.URL, metrics=self.metrics,
+                      timeout=self.timeout, deadline=self.timeLeft(), circuit_breaker=self.circuit_breaker,
+                      **self.pool_options)
+        account.__token_source = (self, viqID, viqName)
+        account.__getVIQInfo()
+        if viqName != account.viqName:
+            logger.error(f"Failed to switch external accounts. Script attempted to switch to {viqName} but got {account.viqName}")
+            raise SystemExit
+        return account
 
     def checkApsBySerial(self, listOfSerials):
         info="check APs by Serial Number"
@@ -370,6 +542,57 @@ class XIQ:
         response = self.__setup_get_api_call(info, url)
         return response
 
+    #PAGINATION
+    def iterPages(self, page_func, limit=100, workers=None, on_total=None, **kwargs):
+        '''
+        Generator over every record of a paged XIQ listing. Page 1 is fetched first to learn total_pages,
+        then pages 2..N are fetched concurrently, at most `workers` pages ahead of the consumer.
+        Records are yielded in page order as soon as their page arrives.
+        page_func - bound XIQ method accepting page= and limit= (ex. self.getUsersByGroupID)
+        on_total - called with the listing's total_count once page 1 has arrived (ex. Progress.setTotal)
+        '''
+        if workers is None:
+            workers = self.page_workers
+        response = page_func(page=1, limit=limit, **kwargs)
+        total_pages = response.get("total_pages", 1)
+        if on_total is not None and response.get("total_count") is not None:
+            on_total(int(response["total_count"]))
+        yield from response.get("data", [])
+        if total_pages <= 1:
+            return
+
+        def fetch_page(pg):
+            return page_func(page=pg, limit=limit, **kwargs).get("data", [])
+
+        window = max(min(workers, total_pages - 1), 1)
+        with ThreadPoolExecutor(max_workers=window) as executor:
+            pending = deque()
+            next_page = 2
+            while next_page <= total_pages or pending:
+                while next_page <= total_pages and len(pending) < window:
+                    pending.append(executor.submit(fetch_page, next_page))
+                    next_page += 1
+                yield from pending.popleft().result()
+
+    def getAllPages(self, page_func, limit=100, workers=None, **kwargs):
+        return list(self.iterPages(page_func, limit=limit, workers=workers, **kwargs))
+
+    def iterUserGroups(self, type=None, limit=100):
+        return self.iterPages(self.getUserGroups, limit=limit, type=type)
+
+    def iterUsersByGroupID(self, group_id, limit=100, on_total=None):
+        return self.iterPages(self.getUsersByGroupID, limit=limit, on_total=on_total, group_id=group_id)
+
+    def getUserCount(self, group_id):
+        response = self.getUsersByGroupID(group_id, page=1, limit=1)
+        return int(response.get("total_count", 0))
+
+    def getAllUserGroups(self, type=None, limit=100):
+        return self.getAllPages(self.getUserGroups, limit=limit, type=type)
+
+    def getAllUsersByGroupID(self, group_id, limit=100):
+        return self.getAllPages(self.getUsersByGroupID, limit=limit, group_id=group_id)
+
     def getRadioProfiles(self, page=1, limit=10):
         info = "Get Radio Profiles"
         # page = 1
@@ -389,6 +612,14 @@ class XIQ:
         url = self.URL + f"/radio-profiles/radio-usage-opt/{id}"
         response = self.__setup_get_api_call(info, url)
         return response
-    def postAPICall(self, url, payload=None, info=None):
+    def lastCallFailures(self):
+        '''
+        Failed attempts of the last API call made by the calling thread, oldest first: the HTTP status of
+        each retryable failure (None for connection errors and timeouts) or "error" for other failures.
+        '''
+        return list(getattr(self.__last_endpoint, "failures", []))
+
+    def postAPICall(self, url, payload=None, info=None, raise_errors=False):
+        # raise_errors - raise XIQError when the call fails for good instead of exiting the script
         url = self.URL + url
-        return self.__setup_post_api_call(info, url, payload)
+        return self.__setup_post_api_call(info, url, payload, raise_errors)